@@ -20,13 +20,75 @@ import matplotlib.pyplot as plt
 import numpy
 from matplotlib.backends.backend_pdf import PdfPages
 
+from tag_table import read_tag_table, read_tag_table_chunks
+
 plt.switch_backend('agg')
 
 
 def readFileReferenceFree(file):
-    with open(file, 'r') as dest_f:
-        data_array = numpy.genfromtxt(dest_f, skip_header=0, delimiter='\t', comments='#', dtype='string')
-        return(data_array)
+    # family sizes, tags and ab/ba of the file as typed columns
+    fs, seq, tags = read_tag_table(file)
+    return (fs.astype(int), seq, tags)
+
+
+def addCounts(counts, other):
+    if len(other) > len(counts):
+        counts, other = other, counts
+    counts[:len(other)] += other
+    return counts
+
+
+def familySizeCounts(file):
+    # nr. of tags per FS of all tags and of the ab and ba tags, the file is read in chunks
+    fs_counts = numpy.zeros(1, dtype=numpy.int64)
+    strand_counts = [numpy.zeros(1, dtype=numpy.int64), numpy.zeros(1, dtype=numpy.int64)]
+    for fs, tags, strands in read_tag_table_chunks(file):
+        fs_counts = addCounts(fs_counts, numpy.bincount(fs))
+        for nr, strand in enumerate(("ab", "ba")):
+            strand_counts[nr] = addCounts(strand_counts[nr], numpy.bincount(fs[strands == strand]))
+    return (fs_counts, strand_counts)
+
+
+def binnedCounts(fs_counts):
+    # nr. of tags and of PE reads in the bins FS=1, ..., FS=20, FS>20 of the plots (index 0 is not used)
+    fs = numpy.arange(len(fs_counts))
+    bin_of_fs = numpy.clip(fs, 1, 21)
+    tags = numpy.bincount(bin_of_fs, weights=fs_counts, minlength=22).astype(numpy.int64)
+    reads = numpy.bincount(bin_of_fs, weights=fs_counts * numpy.maximum(fs, 1), minlength=22).astype(numpy.int64)
+    return (tags, reads)
+
+
+def medianFromCounts(fs_counts):
+    cumulative = numpy.cumsum(fs_counts)
+    lower = numpy.searchsorted(cumulative, (cumulative[-1] - 1) // 2, side="right")
+    upper = numpy.searchsorted(cumulative, cumulative[-1] // 2, side="right")
+    return numpy.float64(lower + upper) / 2
+
+
+def writeDatasetSummary(output_file, name_file, count, sep):
+    # max., median and mean FS, singletons and FS > 20 of one dataset from the nr. of tags per FS
+    reads = count * numpy.arange(len(count))
+    nr_tags = count.sum()
+    singl = count[1]
+    last = count[21:].sum()  # large families
+    output_file.write("\nDataset:{}{}\n".format(sep, name_file))
+    output_file.write("max. family size:{}{}\n".format(sep, len(count) - 1))
+    output_file.write("absolute frequency:{}{}\n".format(sep, count[len(count) - 1]))
+    output_file.write("relative frequency:{}{:.3f}\n\n".format(sep, float(count[len(count) - 1]) / sum(count)))
+
+    output_file.write("median family size:{}{}\n".format(sep, medianFromCounts(count)))
+    output_file.write("mean family size:{}{}\n\n".format(sep, numpy.float64(reads.sum()) / nr_tags))
+
+    output_file.write(
+        "{}singletons:{}{}{}family size > 20:{}{}{}{}length of dataset:\n".format(sep, sep, sep, sep, sep, sep,
+                                                                                  sep, sep))
+    output_file.write(
+        "{}nr. of tags{}rel. freq of tags{}rel.freq of PE reads{}nr. of tags{}rel. freq of tags{}nr. of PE reads{}rel. freq of PE reads{}total nr. of tags{}total nr. of PE reads\n".format(
+            sep, sep, sep, sep, sep, sep, sep, sep, sep))
+    output_file.write("{}{}{}{}{:.3f}{}{:.3f}{}{}{}{:.3f}{}{}{}{:.3f}{}{}{}{}\n\n".format(
+        name_file, sep, singl, sep, float(singl) / nr_tags, sep, float(singl) / reads.sum(), sep,
+        last, sep, float(last) / nr_tags, sep, reads[21:].sum(), sep, float(reads[21:].sum()) / reads.sum(), sep,
+        nr_tags, sep, reads.sum()))
 
 
 def make_argparser():
@@ -41,6 +103,9 @@ def make_argparser():
     parser.add_argument('--inputName4')
     parser.add_argument('--log_axis', action="store_false", help='Transform y axis in log scale.')
     parser.add_argument('--rel_freq', action="store_false", help='If False, the relative frequencies are displayed.')
+    parser.add_argument('--streaming', action="store_true",
+                        help='The input files are read in chunks and only the counts of the family sizes are kept, '
+                             'without the DCS and SSCS of the tags. For large files with bounded memory.')
     parser.add_argument('--output_pdf', default="data.pdf", type=str, help='Name of the pdf file.')
     parser.add_argument('--output_tabular', default="data.tabular", type=str, help='Name of the tabular file.')
     return parser
@@ -61,6 +126,7 @@ def compare_read_families(argv):
     name4 = args.inputName4
     log_axis = args.log_axis
     rel_freq = args.rel_freq
+    streaming = args.streaming
 
     title_file = args.output_tabular
     title_file2 = args.output_pdf
@@ -76,7 +142,10 @@ def compare_read_families(argv):
     list_to_plot = []
     label = []
     data_array_list = []
-    list_to_plot_original = []
+    fs_counts_list = []
+    strand_counts_list = []
+    tag_counts = []
+    read_counts = []
     colors = []
     bins = numpy.arange(1, 22)
     with open(title_file, "w") as output_file, PdfPages(title_file2) as pdf:
@@ -85,185 +154,50 @@ def compare_read_families(argv):
         fig2 = plt.figure()
         fig2.subplots_adjust(left=0.12, right=0.97, bottom=0.23, top=0.94, hspace=0)
 
-        if firstFile is not None:
-            file1 = readFileReferenceFree(firstFile)
-            integers = numpy.array(file1[:, 0]).astype(int)  # keep original family sizes
-            list_to_plot_original.append(integers)
-            colors.append("#0000FF")
-
-            # for plot: replace all big family sizes by 22
-            data1 = numpy.clip(integers, bins[0], bins[-1])
-            name1 = name1.split(".tabular")[0]
-            if len(name1) > 40:
-                name1 = name1[:40]
-            list_to_plot.append(data1)
-            label.append(name1)
-            data_array_list.append(file1)
-
-            legend = "\n\n\n{}".format(name1)
-            fig.text(0.05, 0.11, legend, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.05, 0.11, legend, size=10, transform=plt.gcf().transFigure)
-
-            legend1 = "singletons:\nnr. of tags\n{:,} ({:.3f})".format(numpy.bincount(data1)[1],
-                                                                       float(numpy.bincount(data1)[1]) / len(data1))
-            fig.text(0.32, 0.11, legend1, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.32, 0.11, legend1, size=10, transform=plt.gcf().transFigure)
-
-            legend3b = "PE reads\n{:,} ({:.3f})".format(numpy.bincount(data1)[1],
-                                                        float(numpy.bincount(data1)[1]) / sum(integers))
-            fig.text(0.45, 0.11, legend3b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.45, 0.11, legend3b, size=10, transform=plt.gcf().transFigure)
-
-            legend4 = "family size > 20:\nnr. of tags\n{:,} ({:.3f})".format(len(integers[integers > 20]),
-                                                                             float(len(integers[integers > 20])) / len(integers))
-            fig.text(0.58, 0.11, legend4, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.58, 0.11, legend4, size=10, transform=plt.gcf().transFigure)
-
-            legend5 = "PE reads\n{:,} ({:.3f})".format(sum(integers[integers > 20]),
-                                                       float(sum(integers[integers > 20])) / sum(integers))
-            fig.text(0.70, 0.11, legend5, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.70, 0.11, legend5, size=10, transform=plt.gcf().transFigure)
-
-            legend6 = "total nr. of\ntags\n{:,}".format(len(data1))
-            fig.text(0.82, 0.11, legend6, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.82, 0.11, legend6, size=10, transform=plt.gcf().transFigure)
-
-            legend6b = "PE reads\n{:,}".format(sum(integers))
-            fig.text(0.89, 0.11, legend6b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.89, 0.11, legend6b, size=10, transform=plt.gcf().transFigure)
-
-        if secondFile is not None:
-            file2 = readFileReferenceFree(secondFile)
-            integers2 = numpy.array(file2[:, 0]).astype(int)  # keep original family sizes
-            list_to_plot_original.append(integers2)
-            colors.append("#298A08")
-
-            data2 = numpy.clip(integers2, bins[0], bins[-1])
-            list_to_plot.append(data2)
-            name2 = name2.split(".tabular")[0]
-            if len(name2) > 40:
-                name2 = name2[:40]
-            label.append(name2)
-            data_array_list.append(file2)
-
-            fig.text(0.05, 0.09, name2, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.05, 0.09, name2, size=10, transform=plt.gcf().transFigure)
-
-            legend1 = "{:,} ({:.3f})".format(numpy.bincount(data2)[1], float(numpy.bincount(data2)[1]) / len(data2))
-            fig.text(0.32, 0.09, legend1, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.32, 0.09, legend1, size=10, transform=plt.gcf().transFigure)
-
-            legend3 = "{:,} ({:.3f})".format(numpy.bincount(data2)[1], float(numpy.bincount(data2)[1]) / sum(integers2))
-            fig.text(0.45, 0.09, legend3, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.45, 0.09, legend3, size=10, transform=plt.gcf().transFigure)
-
-            legend4 = "{:,} ({:.3f})".format(len(integers2[integers2 > 20]),
-                                             float(len(integers2[integers2 > 20])) / len(integers2))
-            fig.text(0.58, 0.09, legend4, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.58, 0.09, legend4, size=10, transform=plt.gcf().transFigure)
-
-            legend5 = "{:,} ({:.3f})".format(sum(integers2[integers2 > 20]),
-                                             float(sum(integers2[integers2 > 20])) / sum(integers2))
-            fig.text(0.70, 0.09, legend5, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.70, 0.09, legend5, size=10, transform=plt.gcf().transFigure)
-
-            legend6 = "{:,}".format(len(data2))
-            fig.text(0.82, 0.09, legend6, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.82, 0.09, legend6, size=10, transform=plt.gcf().transFigure)
-
-            legend6b = "{:,}".format(sum(integers2))
-            fig.text(0.89, 0.09, legend6b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.89, 0.09, legend6b, size=10, transform=plt.gcf().transFigure)
-
-        if thirdFile is not None:
-            file3 = readFileReferenceFree(thirdFile)
-            integers3 = numpy.array(file3[:, 0]).astype(int)  # keep original family sizes
-            list_to_plot_original.append(integers3)
-            colors.append("#DF0101")
-
-            data3 = numpy.clip(integers3, bins[0], bins[-1])
-            list_to_plot.append(data3)
-            name3 = name3.split(".tabular")[0]
-            if len(name3) > 40:
-                name3 = name3[:40]
-            label.append(name3)
-            data_array_list.append(file3)
-
-            fig.text(0.05, 0.07, name3, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.05, 0.07, name3, size=10, transform=plt.gcf().transFigure)
-
-            legend1 = "{:,} ({:.3f})".format(numpy.bincount(data3)[1], float(numpy.bincount(data3)[1]) / len(data3))
-            fig.text(0.32, 0.07, legend1, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.32, 0.07, legend1, size=10, transform=plt.gcf().transFigure)
-
-            legend3b = "{:,} ({:.3f})".format(numpy.bincount(data3)[1],
-                                              float(numpy.bincount(data3)[1]) / sum(integers3))
-            fig.text(0.45, 0.07, legend3b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.45, 0.07, legend3b, size=10, transform=plt.gcf().transFigure)
-
-            legend4 = "{:,} ({:.3f})".format(len(integers3[integers3 > 20]),
-                                             float(len(integers3[integers3 > 20])) / len(integers3))
-            fig.text(0.58, 0.07, legend4, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.58, 0.07, legend4, size=10, transform=plt.gcf().transFigure)
-
-            legend5 = "{:,} ({:.3f})".format(sum(integers3[integers3 > 20]),
-                                             float(sum(integers3[integers3 > 20])) / sum(integers3))
-            fig.text(0.70, 0.07, legend5, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.70, 0.07, legend5, size=10, transform=plt.gcf().transFigure)
-
-            legend6 = "{:,}".format(len(data3))
-            fig.text(0.82, 0.07, legend6, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.82, 0.07, legend6, size=10, transform=plt.gcf().transFigure)
-
-            legend6b = "{:,}".format(sum(integers3))
-            fig.text(0.89, 0.07, legend6b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.89, 0.07, legend6b, size=10, transform=plt.gcf().transFigure)
-
-        if fourthFile is not None:
-            file4 = readFileReferenceFree(fourthFile)
-            integers4 = numpy.array(file4[:, 0]).astype(int)  # keep original family sizes
-            list_to_plot_original.append(integers4)
-            colors.append("#04cec7")
-
-            data4 = numpy.clip(integers4, bins[0], bins[-1])
-            list_to_plot.append(data4)
-            name4 = name4.split(".tabular")[0]
-            if len(name4) > 40:
-                name4 = name4[:40]
-            label.append(name4)
-            data_array_list.append(file4)
-
-            fig.text(0.05, 0.05, name4, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.05, 0.05, name4, size=10, transform=plt.gcf().transFigure)
-
-            legend1 = "{:,} ({:.3f})".format(numpy.bincount(data4)[1], float(numpy.bincount(data4)[1]) / len(data4))
-            fig.text(0.32, 0.05, legend1, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.32, 0.05, legend1, size=10, transform=plt.gcf().transFigure)
-
-            legend3b = "{:,} ({:.3f})".format(numpy.bincount(data4)[1],
-                                              float(numpy.bincount(data4)[1]) / sum(integers4))
-            fig.text(0.45, 0.05, legend3b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.45, 0.05, legend3b, size=10, transform=plt.gcf().transFigure)
-
-            legend4 = "{:,} ({:.3f})".format(len(integers4[integers4 > 20]),
-                                             float(len(integers4[integers4 > 20])) / len(integers4))
-            fig.text(0.58, 0.05, legend4, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.58, 0.05, legend4, size=10, transform=plt.gcf().transFigure)
-
-            legend5 = "{:,} ({:.3f})".format(sum(integers4[integers4 > 20]),
-                                             float(sum(integers4[integers4 > 20])) / sum(integers4))
-            fig.text(0.70, 0.05, legend5, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.70, 0.05, legend5, size=10, transform=plt.gcf().transFigure)
-
-            legend6 = "{:,}".format(len(data4))
-            fig.text(0.82, 0.05, legend6, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.82, 0.05, legend6, size=10, transform=plt.gcf().transFigure)
-
-            legend6b = "{:,}".format(sum(integers4))
-            fig.text(0.89, 0.05, legend6b, size=10, transform=plt.gcf().transFigure)
-            fig2.text(0.89, 0.05, legend6b, size=10, transform=plt.gcf().transFigure)
-
-        list_to_plot2 = list_to_plot
+        datasets = [(firstFile, name1, "#0000FF"), (secondFile, name2, "#298A08"),
+                    (thirdFile, name3, "#DF0101"), (fourthFile, name4, "#04cec7")]
+        for nr, (file, name, color) in enumerate(datasets):
+            if file is None:
+                continue
+            if streaming:
+                fs_counts, strand_counts = familySizeCounts(file)
+                strand_counts_list.append(strand_counts)
+            else:
+                file1 = readFileReferenceFree(file)
+                integers = file1[0]  # keep original family sizes
+                fs_counts = numpy.bincount(integers)
+                # for plot: replace all big family sizes by 22
+                list_to_plot.append(numpy.clip(integers, bins[0], bins[-1]))
+                data_array_list.append(file1)
+            fs_counts_list.append(fs_counts)
+            tags, reads = binnedCounts(fs_counts)
+            tag_counts.append(tags)
+            read_counts.append(reads)
+            total_reads = (fs_counts * numpy.arange(len(fs_counts))).sum()
+            colors.append(color)
+
+            name = name.split(".tabular")[0]
+            if len(name) > 40:
+                name = name[:40]
+            label.append(name)
+
+            # extra information beneath the plots, with the headers above the first dataset
+            y_text = 0.11 - 0.02 * nr
+            headers = nr == 0
+            texts = [(0.05, "\n\n\n{}".format(name) if headers else name),
+                     (0.32, "{}{:,} ({:.3f})".format("singletons:\nnr. of tags\n" if headers else "", tags[1],
+                                                     float(tags[1]) / tags.sum())),
+                     (0.45, "{}{:,} ({:.3f})".format("PE reads\n" if headers else "", tags[1],
+                                                     float(tags[1]) / total_reads)),
+                     (0.58, "{}{:,} ({:.3f})".format("family size > 20:\nnr. of tags\n" if headers else "", tags[21],
+                                                     float(tags[21]) / tags.sum())),
+                     (0.70, "{}{:,} ({:.3f})".format("PE reads\n" if headers else "", reads[21],
+                                                     float(reads[21]) / total_reads)),
+                     (0.82, "{}{:,}".format("total nr. of\ntags\n" if headers else "", tags.sum())),
+                     (0.89, "{}{:,}".format("PE reads\n" if headers else "", total_reads))]
+            for x_text, text in texts:
+                fig.text(x_text, y_text, text, size=10, transform=plt.gcf().transFigure)
+                fig2.text(x_text, y_text, text, size=10, transform=plt.gcf().transFigure)
 
         if rel_freq:
             ylab = "Relative Frequency"
@@ -277,12 +211,14 @@ def compare_read_families(argv):
         ticks1 = map(str, ticks)
         ticks1[len(ticks1) - 1] = ">20"
         ax.set_xticks([], [])
+        # the histograms are drawn from the counts of the bins
+        bin_values = [bins] * len(tag_counts)
         if rel_freq:
-            w = [numpy.zeros_like(data) + 1. / len(data) for data in list_to_plot2]
-            counts = ax.hist(list_to_plot2, weights=w, bins=numpy.arange(1, 23), stacked=False, edgecolor="black", color=colors, linewidth=1, label=label, align="left", alpha=0.7, rwidth=0.8)
+            w = [tag_bins[1:] / float(tag_bins.sum()) for tag_bins in tag_counts]
+            counts = ax.hist(bin_values, weights=w, bins=numpy.arange(1, 23), stacked=False, edgecolor="black", color=colors, linewidth=1, label=label, align="left", alpha=0.7, rwidth=0.8)
             ax.set_ylim(0, 1.07)
         else:
-            counts = ax.hist(list_to_plot2, bins=numpy.arange(1, 23), stacked=False, edgecolor="black", linewidth=1, label=label, align="left", alpha=0.7, rwidth=0.8, color=colors)
+            counts = ax.hist(bin_values, weights=[tag_bins[1:] for tag_bins in tag_counts], bins=numpy.arange(1, 23), stacked=False, edgecolor="black", linewidth=1, label=label, align="left", alpha=0.7, rwidth=0.8, color=colors)
         ax.set_xticks(numpy.array(ticks))
         ax.set_xticklabels(ticks1)
         ax.legend(loc='upper right', fontsize=14, frameon=True, bbox_to_anchor=(0.9, 1))
@@ -304,38 +240,34 @@ def compare_read_families(argv):
         reads = []
         reads_rel = []
 
-        barWidth = 0 - (len(list_to_plot) + 1) / 2 * 1. / (len(list_to_plot) + 1)
+        barWidth = 0 - (len(label) + 1) / 2 * 1. / (len(label) + 1)
         ax2.set_xticks([], [])
 
-        for i in range(len(list_to_plot2)):
+        for i in range(len(label)):
             x = list(numpy.arange(1, 22).astype(float))
-            unique, c = numpy.unique(list_to_plot2[i], return_counts=True)
-            y = unique * c
-            if sum(list_to_plot_original[i] > 20) > 0:
-                y[len(y) - 1] = sum(list_to_plot_original[i][list_to_plot_original[i] > 20])
-            y = [y[x[idx] == unique][0] if x[idx] in unique else 0 for idx in range(len(x))]
+            y = list(read_counts[i][1:])
             reads.append(y)
             reads_rel.append(list(numpy.float_(y)) / sum(y))
 
-            if len(list_to_plot2) == 1:
+            if len(label) == 1:
                 x = [xi * 0.5 for xi in x]
                 w = 0.4
             else:
                 x = [xi + barWidth for xi in x]
-                w = 1. / (len(list_to_plot) + 1)
+                w = 1. / (len(label) + 1)
             if rel_freq:
                 ax2.bar(x, list(numpy.float_(y)) / numpy.sum(y), align="edge", width=w, edgecolor="black", label=label[i], linewidth=1, alpha=0.7, color=colors[i])
                 ax2.set_ylim(0, 1.07)
             else:
                 ax2.bar(x, y, align="edge", width=w, edgecolor="black", label=label[i], linewidth=1, alpha=0.7, color=colors[i])
-            if i == len(list_to_plot2) - 1:
-                barWidth += 1. / (len(list_to_plot) + 1) + 1. / (len(list_to_plot) + 1)
+            if i == len(label) - 1:
+                barWidth += 1. / (len(label) + 1) + 1. / (len(label) + 1)
             else:
-                barWidth += 1. / (len(list_to_plot) + 1)
+                barWidth += 1. / (len(label) + 1)
 
         ax2.legend(loc='upper right', fontsize=14, frameon=True, bbox_to_anchor=(0.9, 1))
 
-        if len(list_to_plot2) == 1:
+        if len(label) == 1:
             ax2.set_xticks(numpy.array([xi + 0.2 for xi in x]))
         else:
             ax2.set_xticks(numpy.array(ticks))
@@ -351,7 +283,7 @@ def compare_read_families(argv):
         plt.close()
 
         # write data to CSV file tags
-        counts = [numpy.bincount(di, minlength=22)[1:] for di in list_to_plot2]  # original counts of family sizes
+        counts = [tag_bins[1:] for tag_bins in tag_counts]  # original counts of family sizes
         output_file.write("Values from family size distribution with all datasets based on families\n")
         output_file.write("\nFamily size")
         for i in label:
@@ -402,11 +334,8 @@ def compare_read_families(argv):
         output_file.write("\n")
 
         # Family size distribution after DCS and SSCS
-        for dataset, data_o, name_file in zip(list_to_plot, data_array_list, label):
-            tags = numpy.array(data_o[:, 2])
-            seq = numpy.array(data_o[:, 1])
+        for dataset, (data_o, seq, tags), name_file in zip(list_to_plot, data_array_list, label):
             data = numpy.array(dataset)
-            data_o = numpy.array(data_o[:, 0]).astype(int)
             # find all unique tags and get the indices for ALL tags, but only once
             u, index_unique, c = numpy.unique(numpy.array(seq), return_counts=True, return_index=True)
             d = u[c > 1]
@@ -660,26 +589,7 @@ def compare_read_families(argv):
             plt.close()
 
             # write same information to a csv file
-            count = numpy.bincount(data_o)  # original counts of family sizes
-
-            output_file.write("\nDataset:{}{}\n".format(sep, name_file))
-            output_file.write("max. family size:{}{}\n".format(sep, max(data_o)))
-            output_file.write("absolute frequency:{}{}\n".format(sep, count[len(count) - 1]))
-            output_file.write("relative frequency:{}{:.3f}\n\n".format(sep, float(count[len(count) - 1]) / sum(count)))
-
-            output_file.write("median family size:{}{}\n".format(sep, numpy.median(numpy.array(data_o))))
-            output_file.write("mean family size:{}{}\n\n".format(sep, numpy.mean(numpy.array(data_o))))
-
-            output_file.write(
-                "{}singletons:{}{}{}family size > 20:{}{}{}{}length of dataset:\n".format(sep, sep, sep, sep, sep, sep,
-                                                                                          sep, sep))
-            output_file.write(
-                "{}nr. of tags{}rel. freq of tags{}rel.freq of PE reads{}nr. of tags{}rel. freq of tags{}nr. of PE reads{}rel. freq of PE reads{}total nr. of tags{}total nr. of PE reads\n".format(
-                    sep, sep, sep, sep, sep, sep, sep, sep, sep))
-            output_file.write("{}{}{}{}{:.3f}{}{:.3f}{}{}{}{:.3f}{}{}{}{:.3f}{}{}{}{}\n\n".format(
-                name_file, sep, singl, sep, float(singl) / len(data), sep, float(singl) / sum(data_o), sep,
-                last, sep, float(last) / len(data), sep, sum(data_o[data_o > 20]), sep, float(sum(data_o[data_o > 20])) / sum(data_o), sep, len(data),
-                sep, sum(data_o)))
+            writeDatasetSummary(output_file, name_file, numpy.bincount(data_o), sep)
 
             # information for FS >= 1
             output_file.write(
@@ -790,6 +700,22 @@ def compare_read_families(argv):
                 output_file.write("{}{}".format(int(sum(i)), sep))
             output_file.write("{}\n".format(sum(reads[0] + reads[1] + reads[2])))
 
+        if streaming:
+            # the ab and ba tags are not paired to DCSs, this needs all tags in memory (without --streaming)
+            for count, strand_counts, name_file in zip(fs_counts_list, strand_counts_list, label):
+                writeDatasetSummary(output_file, name_file, count, sep)
+                output_file.write("The DCS and SSCS of the tags are not determined in the streaming mode.\n\n")
+                strand_bins = [binnedCounts(strand_count) for strand_count in strand_counts]
+                for title, nr in (("families", 0), ("PE reads", 1)):
+                    output_file.write("Values from family size distribution based on {}\n".format(title))
+                    output_file.write("{}ab{}ba{}sum\n".format(sep, sep, sep))
+                    for j, fs in enumerate(bins):
+                        fs = ">20" if fs == 21 else "={}".format(fs)
+                        values = [binned[nr][j + 1] for binned in strand_bins]
+                        output_file.write("FS{}{}{}{}{}{}{}\n".format(fs, sep, values[0], sep, values[1], sep, sum(values)))
+                    values = [binned[nr][1:].sum() for binned in strand_bins]
+                    output_file.write("sum{}{}{}{}{}{}\n\n".format(sep, values[0], sep, values[1], sep, sum(values)))
+
     print("Files successfully created!")
 
 
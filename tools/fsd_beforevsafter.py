@@ -22,19 +22,21 @@ import pysam
 from Bio import SeqIO
 from matplotlib.backends.backend_pdf import PdfPages
 
+from tag_table import open_input, read_tag_table
+
 plt.switch_backend('agg')
 
 
 def readFileReferenceFree(file, delim):
-    with open(file, 'r') as dest_f:
-        data_array = numpy.genfromtxt(dest_f, skip_header=0, delimiter=delim, comments='#', dtype='string')
-        return data_array
+    # family sizes, tags and ab/ba of the file as typed columns
+    quant, seq, tags = read_tag_table(file, delim)
+    return (quant.astype(int), seq, tags)
 
 
 def readFasta(file):
     tag_consensus = []
     fs_consensus = []
-    with open(file, "r") as consFile:
+    with open_input(file) as consFile:
         for record in SeqIO.parse(consFile, "fasta"):
             tag_consensus.append(record.id)
             line = record.description
@@ -91,9 +93,8 @@ def compare_read_families_read_loss(argv):
 
 # data with tags of SSCS
         data_array = readFileReferenceFree(SSCS_file, "\t")
-        seq = numpy.array(data_array[:, 1])
-        tags = numpy.array(data_array[:, 2])
-        quant = numpy.array(data_array[:, 0]).astype(int)
+        seq, tags = data_array[1], data_array[2]
+        quant = numpy.array(data_array[0])  # copy, the large families are grouped below
 
         # split data with all tags of SSCS after ab and ba strands
         all_ab = seq[numpy.where(tags == "ab")[0]]
@@ -212,7 +213,7 @@ def compare_read_families_read_loss(argv):
 
             legend = "AB\n{}\n{}\n{:.5f}\n\n{:,}" \
                 .format(max(quant_ab_ref), count[len(count) - 1], float(count[len(count) - 1]) / sum(count),
-                        sum(numpy.array(data_array[:, 0]).astype(int)))
+                        sum(data_array[0]))
             plt.text(0.35, 0.105, legend, size=11, transform=plt.gcf().transFigure)
 
             count2 = numpy.array(
@@ -245,7 +246,7 @@ def compare_read_families_read_loss(argv):
                 "relative frequency:{}{:.3f}{}{:.3f}\n\n".format(sep, float(count[len(count) - 1]) / sum(count), sep,
                                                                  float(count2[len(count2) - 1]) / sum(count2)))
 
-        output_file.write("\ntotal nr. of reads before SSCS building{}{}\n".format(sep, sum(numpy.array(data_array[:, 0]).astype(int))))
+        output_file.write("\ntotal nr. of reads before SSCS building{}{}\n".format(sep, sum(data_array[0])))
         output_file.write("\n\nValues from family size distribution\n")
 
         if afterTrimming is None and ref_genome is None:
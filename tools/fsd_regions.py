@@ -25,13 +25,15 @@ import numpy as np
 import pysam
 from matplotlib.backends.backend_pdf import PdfPages
 
+from tag_table import open_input, read_tag_table
+
 plt.switch_backend('agg')
 
 
 def readFileReferenceFree(file, delim):
-    with open(file, 'r') as dest_f:
-        data_array = np.genfromtxt(dest_f, skip_header=0, delimiter=delim, comments='#', dtype='string')
-        return data_array
+    # family sizes, tags and ab/ba of the file as typed columns
+    quant, seq, tags = read_tag_table(file, delim)
+    return (quant.astype(int), seq, tags)
 
 
 def make_argparser():
@@ -67,7 +69,7 @@ def compare_read_families_refGenome(argv):
         qname_dict = collections.OrderedDict()
 
         if rangesFile is not None:
-            with open(rangesFile, 'r') as regs:
+            with open_input(rangesFile) as regs:
                 range_array = np.genfromtxt(regs, skip_header=0, delimiter='\t', comments='#', dtype='string')
 
             if range_array.ndim == 0:
@@ -117,9 +119,7 @@ def compare_read_families_refGenome(argv):
                     else:
                         qname_dict[read.reference_name].append(tags)
 
-        seq = np.array(data_array[:, 1])
-        tags = np.array(data_array[:, 2])
-        quant = np.array(data_array[:, 0]).astype(int)
+        quant, seq, tags = data_array
         group = np.array(qname_dict.keys())
 
         all_ab = seq[np.where(tags == "ab")[0]]
@@ -192,7 +192,7 @@ def compare_read_families_refGenome(argv):
         legend = "max. family size:\nabsolute frequency:\nrelative frequency:\n\ntotal nr. of reads:\n(before SSCS building)"
         plt.text(0.15, 0.085, legend, size=11, transform=plt.gcf().transFigure)
 
-        legend = "AB\n{}\n{}\n{:.5f}\n\n{:,}".format(max(map(int, quant_ab)), count[len(count) - 1], float(count[len(count) - 1]) / sum(count), sum(np.array(data_array[:, 0]).astype(int)))
+        legend = "AB\n{}\n{}\n{:.5f}\n\n{:,}".format(max(map(int, quant_ab)), count[len(count) - 1], float(count[len(count) - 1]) / sum(count), sum(data_array[0]))
         plt.text(0.35, 0.105, legend, size=11, transform=plt.gcf().transFigure)
 
         count2 = np.bincount(map(int, quant_ba))  # original counts
@@ -228,7 +228,7 @@ def compare_read_families_refGenome(argv):
         output_file.write("max. family size:{}{}{}{}\n".format(sep, max(map(int, quant_ab)), sep, max(map(int, quant_ba))))
         output_file.write("absolute frequency:{}{}{}{}\n".format(sep, count[len(count) - 1], sep, count2[len(count2) - 1]))
         output_file.write("relative frequency:{}{:.3f}{}{:.3f}\n\n".format(sep, float(count[len(count) - 1]) / sum(count), sep, float(count2[len(count2) - 1]) / sum(count2)))
-        output_file.write("total nr. of reads{}{}\n".format(sep, sum(np.array(data_array[:, 0]).astype(int))))
+        output_file.write("total nr. of reads{}{}\n".format(sep, sum(data_array[0])))
         output_file.write("total nr. of tags{}{} ({})\n".format(sep, length_regions, length_regions / 2))
         output_file.write("\n\nValues from family size distribution\n")
         output_file.write("{}".format(sep))
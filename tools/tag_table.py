@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+# Reader of the tabular files with family size, tag and ab/ba of the SSCSs, shared by the tools
+#
+# The columns are parsed directly from the bytes of the file into typed arrays: the family sizes as uint32,
+# the tags as fixed-width strings (S{length of the tag}) and ab/ba as strings of 2 characters. Files that are not
+# in this simple format (comments, carriage returns, spaces, other nr. of columns) are read with numpy.genfromtxt.
+#
+# If the environment variable TAG_TABLE_CACHE_DIR is set, the parsed columns of a file are written on the first
+# read to a binary cache in this directory and memory-mapped (see map_arrays) on all later reads, also by the other
+# tools. A cache is only used while the size, modification time and hash of the start and end of the file are
+# unchanged.
+#
+# The files can be compressed with gzip or bgzip. The blocks of BGZF files are decompressed in parallel threads,
+# one chunk of blocks ahead of the parser.
+
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
+import numpy
+
+# nr. of lines that are parsed at once, limits the memory of the index arrays
+LINES_PER_CHUNK = 2 ** 16
+# bytes of the file that are read at once by read_tag_table_chunks
+BYTES_PER_CHUNK = 2 ** 24
+MAX_FS_DIGITS = 10
+CACHE_DIR_VARIABLE = "TAG_TABLE_CACHE_DIR"
+CACHE_VERSION = 2
+# bytes at the start and at the end of the file that are hashed for the key of the cache
+HASH_BYTES = 2 ** 20
+GZIP_MAGIC = "\x1f\x8b"
+BGZF_MAGIC = "\x1f\x8b\x08\x04"
+# the arrays of write_arrays start at multiples of this nr. of bytes
+ARRAY_ALIGNMENT = 64
+
+
+def field_chars(buf, starts, ends):
+    # characters of one field per line as a 2D uint8 array, right-padded with zeros
+    lengths = ends - starts
+    width = lengths.max()
+    positions = numpy.arange(width)
+    inside = positions < lengths[:, None]
+    chars = buf[numpy.minimum(starts[:, None] + positions, len(buf) - 1)]
+    chars[~inside] = 0
+    return chars, inside
+
+
+def field_strings(buf, starts, ends):
+    chars, inside = field_chars(buf, starts, ends)
+    return numpy.ascontiguousarray(chars).view("S{}".format(chars.shape[1])).ravel()
+
+
+def field_integers(buf, starts, ends):
+    # decimal integers, None if a field has any other character
+    chars, inside = field_chars(buf, starts, ends)
+    digits = chars.astype(numpy.int64) - ord("0")
+    if ((digits < 0) | (digits > 9))[inside].any():
+        return None
+    powers = numpy.clip((ends - starts)[:, None] - 1 - numpy.arange(chars.shape[1]), 0, None)
+    return (numpy.where(inside, digits * 10 ** powers, 0)).sum(axis=1)
+
+
+def parse_tag_table(text, delim="\t"):
+    # (family sizes, tags, ab/ba) of the text of a tabular file, None if the text is not in the simple format
+    if "#" in text or "\r" in text or " " in text:
+        return None
+    if not text.endswith("\n"):
+        text += "\n"
+    buf = numpy.frombuffer(text, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(buf == ord("\n"))
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    lines = ends > starts  # empty lines are skipped
+    starts, ends = starts[lines], ends[lines]
+    delims = numpy.flatnonzero(buf == ord(delim))
+    if len(starts) == 0 or len(delims) != 2 * len(starts):
+        return None
+    first, second = delims[0::2], delims[1::2]
+    if not ((starts < first) & (first + 1 < second) & (second + 1 < ends)).all() or \
+            (first[1:] < ends[:-1]).any() or (first - starts).max() > MAX_FS_DIGITS:
+        return None  # empty fields or fields of other lines
+
+    fs = numpy.zeros(len(starts), dtype=numpy.uint32)
+    tags = numpy.zeros(len(starts), dtype="S{}".format((second - first - 1).max()))
+    strands = numpy.zeros(len(starts), dtype="S{}".format((ends - second - 1).max()))
+    for chunk in range(0, len(starts), LINES_PER_CHUNK):
+        rows = slice(chunk, chunk + LINES_PER_CHUNK)
+        integers = field_integers(buf, starts[rows], first[rows])
+        if integers is None or (integers > numpy.iinfo(numpy.uint32).max).any():
+            return None
+        fs[rows] = integers
+        tags[rows] = field_strings(buf, first[rows] + 1, second[rows])
+        strands[rows] = field_strings(buf, second[rows] + 1, ends[rows])
+    return (fs, tags, strands)
+
+
+def genfromtxt_tag_table(table, delim="\t"):
+    if table.read(1) == "":
+        data_array = numpy.zeros((0, 3), dtype="S1")
+    else:
+        table.seek(0)
+        data_array = numpy.atleast_2d(numpy.genfromtxt(table, skip_header=0, delimiter=delim, comments='#',
+                                                       dtype='string'))
+        if data_array.size == 0:  # only comments
+            data_array = numpy.zeros((0, 3), dtype="S1")
+    return (data_array[:, 0].astype(numpy.uint32), data_array[:, 1], data_array[:, 2])
+
+
+def compression(file):
+    # "bgzf", "gzip" or None for a plain file
+    with open(file, "rb") as table:
+        header = table.read(18)
+    if not header.startswith(GZIP_MAGIC):
+        return None
+    if header.startswith(BGZF_MAGIC) and header[12:14] == "BC":
+        return "bgzf"
+    return "gzip"
+
+
+def bgzf_blocks(buf):
+    # raw deflate data of the complete BGZF blocks in buf and the end of the last complete block
+    blocks = []
+    start = 0
+    while start + 12 <= len(buf):
+        if buf[start:start + 4] != BGZF_MAGIC:
+            raise IOError("Not a BGZF block at offset {}".format(start))
+        extra_end = start + 12 + struct.unpack_from("<H", buf, start + 10)[0]
+        if extra_end > len(buf):
+            break
+        size = None
+        pos = start + 12
+        while pos + 4 <= extra_end:
+            subfield_length = struct.unpack_from("<H", buf, pos + 2)[0]
+            if buf[pos:pos + 2] == "BC" and subfield_length == 2:
+                size = struct.unpack_from("<H", buf, pos + 4)[0] + 1
+            pos += 4 + subfield_length
+        if size is None:
+            raise IOError("BGZF block without size at offset {}".format(start))
+        if start + size > len(buf):
+            break
+        blocks.append(buf[extra_end:start + size - 8])
+        start += size
+    return blocks, start
+
+
+def inflate_block(data):
+    return zlib.decompress(data, -15)
+
+
+def bgzf_chunks(file, chunk_size, threads):
+    # the next chunk is decompressed by the threads while the current one is parsed
+    proc_pool = ThreadPool(threads)
+    try:
+        pending = None
+        with open(file, "rb") as table:
+            rest = ""
+            while True:
+                block = table.read(chunk_size)
+                if block == "":
+                    break
+                block = rest + block
+                blocks, end = bgzf_blocks(block)
+                rest = block[end:]
+                inflated = proc_pool.map_async(inflate_block, blocks)
+                if pending is not None:
+                    yield "".join(pending.get())
+                pending = inflated
+        if rest != "":
+            raise IOError("Truncated BGZF file: {}".format(file))
+        if pending is not None:
+            yield "".join(pending.get())
+    finally:
+        proc_pool.terminate()
+
+
+def input_chunks(file, chunk_size=BYTES_PER_CHUNK, threads=None):
+    # decompressed text of a plain, gzip or BGZF file in chunks
+    kind = compression(file)
+    if kind == "bgzf":
+        for text in bgzf_chunks(file, chunk_size, threads):
+            yield text
+        return
+    with (gzip.open(file, "rb") if kind == "gzip" else open(file, "rb")) as table:
+        while True:
+            text = table.read(chunk_size)
+            if text == "":
+                break
+            yield text
+
+
+def read_input(file, threads=None):
+    # whole decompressed text of a file
+    if compression(file) is None:
+        with open(file, "rb") as table:
+            return table.read()
+    return "".join(input_chunks(file, threads=threads))
+
+
+def open_input(file):
+    # file object of the decompressed text, for the readers of the other inputs (FASTA, BED)
+    if compression(file) is None:
+        return open(file, "r")
+    return io.BytesIO(read_input(file))
+
+
+def cache_file(file):
+    # path of the cache of a file, None if no cache directory is set
+    cache_dir = os.environ.get(CACHE_DIR_VARIABLE)
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(file)).hexdigest() + ".tagcache")
+
+
+def cache_key(file, delim):
+    stat = os.stat(file)
+    digest = hashlib.sha1()
+    with open(file, "rb") as table:
+        digest.update(table.read(HASH_BYTES))
+        table.seek(max(stat.st_size - HASH_BYTES, table.tell()))
+        digest.update(table.read(HASH_BYTES))
+    return numpy.array([(CACHE_VERSION, stat.st_size, stat.st_mtime, digest.hexdigest(), delim)],
+                       dtype=[("version", "i4"), ("size", "i8"), ("mtime", "f8"), ("hash", "S40"), ("delim", "S1")])
+
+
+def write_arrays(path, arrays):
+    # arrays as consecutive .npy records in one file, aligned for map_arrays; written to a temporary file first,
+    # so that other processes never read an incomplete file; mkstemp creates it only readable by the owner, but the
+    # cache is shared by all users of the cache directory, so it gets the usual mode of new files (umask)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    umask = os.umask(0)
+    os.umask(umask)
+    os.fchmod(descriptor, 0o666 & ~umask)
+    with os.fdopen(descriptor, "wb") as records:
+        for array in arrays:
+            numpy.lib.format.write_array(records, numpy.ascontiguousarray(array), version=(1, 0))
+            records.write("\0" * (-records.tell() % ARRAY_ALIGNMENT))
+    os.rename(temporary, path)
+
+
+def map_arrays(path):
+    # read-only arrays of a file of write_arrays without copying: all arrays are views of one memory map,
+    # processes that map the same file share its pages
+    arrays = []
+    with open(path, "rb") as records:
+        buf = mmap.mmap(records.fileno(), 0, access=mmap.ACCESS_READ)
+        while records.tell() < len(buf):
+            numpy.lib.format.read_magic(records)
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(records)
+            offset = records.tell()
+            count = int(numpy.prod(shape))
+            if count == 0:
+                arrays.append(numpy.zeros(shape, dtype=dtype))
+            else:
+                arrays.append(numpy.frombuffer(buf, dtype=dtype, count=count, offset=offset).reshape(shape))
+            end = offset + count * dtype.itemsize
+            records.seek(end + (-end % ARRAY_ALIGNMENT))
+    return arrays
+
+
+def load_cache(path, key):
+    # the cache holds the key, the family sizes, the tags and ab/ba; None if the cache does not exist or belongs
+    # to another version of the file
+    try:
+        arrays = map_arrays(path)
+    except (EnvironmentError, ValueError):
+        return None
+    if len(arrays) != 4 or arrays[0].dtype != key.dtype or not (arrays[0] == key).all():
+        return None
+    return tuple(arrays[1:])
+
+
+def write_cache(path, key, columns):
+    try:
+        write_arrays(path, (key, ) + tuple(columns))
+    except EnvironmentError:
+        pass  # no cache if the directory is not writable
+
+
+def read_tag_table(file, delim="\t"):
+    # family sizes (uint32), tags and ab/ba of a tabular file with these three columns
+    cache = cache_file(file)
+    if cache is not None:
+        key = cache_key(file, delim)
+        columns = load_cache(cache, key)
+        if columns is not None:
+            return columns
+    text = read_input(file)
+    columns = parse_tag_table(text, delim)
+    if columns is None:
+        columns = genfromtxt_tag_table(StringIO(text), delim)
+    if cache is not None:
+        write_cache(cache, key, columns)
+    return columns
+
+
+def read_tag_table_chunks(file, delim="\t", chunk_size=BYTES_PER_CHUNK):
+    # the columns of the tabular file in chunks of whole lines, the memory does not grow with the size of the file
+    cache = cache_file(file)
+    columns = load_cache(cache, cache_key(file, delim)) if cache is not None else None
+    if columns is not None:
+        for chunk in range(0, len(columns[0]), LINES_PER_CHUNK):
+            yield tuple(numpy.array(column[chunk:chunk + LINES_PER_CHUNK]) for column in columns)
+        return
+    rest = ""
+    for block in input_chunks(file, chunk_size):
+        block = rest + block
+        end = block.rfind("\n") + 1
+        rest = block[end:]
+        if end != 0:
+            columns = parse_tag_table(block[:end], delim)
+            yield columns if columns is not None else genfromtxt_tag_table(StringIO(block[:end]), delim)
+    if rest != "":
+        columns = parse_tag_table(rest, delim)
+        yield columns if columns is not None else genfromtxt_tag_table(StringIO(rest), delim)
@@ -18,22 +18,27 @@
 #        --nr_above_bars True/False --output_tabular outptufile_name_tabular
 
 import argparse
+import cPickle
 import itertools
-import operator
+import os
 import sys
-from collections import Counter, defaultdict
-from functools import partial
+import tempfile
+import time
+from collections import defaultdict
 from multiprocessing.pool import Pool
+from StringIO import StringIO
 
 import matplotlib.pyplot as plt
 import numpy
 from matplotlib.backends.backend_pdf import PdfPages
 
+from tag_table import map_arrays, read_tag_table, write_arrays
+
 plt.switch_backend('agg')
 
 
-def plotFSDwithHD2(familySizeList1, maximumXFS, minimumXFS, originalCounts,
-                   subtitle, pdf, relative=False, diff=True, rel_freq=False):
+def plotFSDwithHD2(table, maximumXFS, minimumXFS, originalCounts,
+                   subtitle, pdf, relative=False, diff=True, rel_freq=False, stratified=False):
     if diff is False:
         colors = ["#e6194b", "#3cb44b", "#ffe119", "#0082c8", "#f58231", "#911eb4"]
         labels = ["TD=1", "TD=2", "TD=3", "TD=4", "TD=5-8", "TD>8"]
@@ -47,7 +52,8 @@ def plotFSDwithHD2(familySizeList1, maximumXFS, minimumXFS, originalCounts,
     fig = plt.figure(figsize=(6, 7))
     ax = fig.add_subplot(111)
     plt.subplots_adjust(bottom=0.1)
-    p1 = numpy.bincount(numpy.concatenate(familySizeList1))
+    uniqueFS, count = table
+    p1 = numpy.bincount(uniqueFS, weights=count.sum(axis=1)).astype(int)
     maximumY = numpy.amax(p1)
 
     if len(range(minimumXFS, maximumXFS)) == 0:
@@ -55,15 +61,15 @@ def plotFSDwithHD2(familySizeList1, maximumXFS, minimumXFS, originalCounts,
     else:
         range1 = range(0, maximumXFS + 2)
 
+    heights, edges = binTable(table, range1)
     if rel_freq:
-        w = [numpy.zeros_like(data) + 1. / len(numpy.concatenate(familySizeList1)) for data in familySizeList1]
-        plt.hist(familySizeList1, label=labels, weights=w, color=colors, stacked=True, rwidth=0.8, alpha=1, align="left", edgecolor="None", bins=range1)
+        plotBars(heights / count.sum(), edges, labels, colors, edgecolor="None")
         plt.ylabel("Relative Frequency", fontsize=14)
         plt.ylim((0, 1.07))
     else:
-        plt.hist(familySizeList1, label=labels, color=colors, stacked=True, rwidth=0.8, alpha=1, align="left", edgecolor="None", bins=range1)
-        if len(numpy.concatenate(familySizeList1)) != 0:
-            plt.ylim((0, max(numpy.bincount(numpy.concatenate(familySizeList1))) * 1.1))
+        plotBars(heights, edges, labels, colors, edgecolor="None")
+        if count.sum() != 0:
+            plt.ylim((0, max(p1) * 1.1))
         plt.ylabel("Absolute Frequency", fontsize=14)
         plt.ylim((0, maximumY * 1.2))
     plt.legend(loc='upper right', fontsize=14, frameon=True, bbox_to_anchor=(1.45, 1))
@@ -89,12 +95,29 @@ def plotFSDwithHD2(familySizeList1, maximumXFS, minimumXFS, originalCounts,
     legend3 = "singletons\n{:,}\n{:.5f}".format(int(p1[1]), float(p1[1]) / sum(p1))
     plt.text(0.7, -0.08, legend3, transform=plt.gcf().transFigure, size=12)
     plt.grid(b=True, which='major', color='#424242', linestyle=':')
+    if stratified:
+        plotStratifiedNote()
     pdf.savefig(fig, bbox_inches="tight")
     plt.close("all")
 
 
-def plotHDwithFSD(list1, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, relative=False,
-                  nr_above_bars=True, nr_unique_chimeras=0, len_sample=0, rel_freq=False):
+def plotStratifiedNote():
+    # the stratified sample has the same nr. of tags in each family size category
+    plt.text(0.14, -0.2, "Stratified sample: the frequencies are those of the sample with the same nr. of tags\n"
+             "in each family size category and not those of the dataset.", size=10, transform=plt.gcf().transFigure)
+
+
+def plotTitlePage(title, pdf):
+    fig = plt.figure(figsize=(6, 8))
+    plt.axis("off")
+    plt.text(0.5, 0.5, title, horizontalalignment="center", verticalalignment="center", fontsize=18)
+    pdf.savefig(fig, bbox_inches="tight")
+    plt.close("all")
+    plt.clf()
+
+
+def plotHDwithFSD(table, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, relative=False,
+                  nr_above_bars=True, nr_unique_chimeras=0, len_sample=0, rel_freq=False, max_td=0, stratified=False):
     if relative is True:
         step = 0.1
     else:
@@ -102,34 +125,31 @@ def plotHDwithFSD(list1, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, rel
 
     fig = plt.figure(figsize=(6, 8))
     plt.subplots_adjust(bottom=0.1)
-    p1 = numpy.array([v for k, v in sorted(Counter(numpy.concatenate(list1)).iteritems())])
+    uniqueHD, count = table
+    p1 = count.sum(axis=1)
+    nr_points = int(count.sum())
     maximumY = numpy.amax(p1)
     if relative is True:  # relative difference
         bin1 = numpy.arange(-1, maximumX + 0.2, 0.1)
     else:
         bin1 = maximumX + 1
 
+    heights, bins = binTable(table, bin1, (0, maximumX + 1))
+    labels = ["FS=1", "FS=2", "FS=3", "FS=4", "FS=5-10", "FS>10"]
+    colors = ["#808080", "#FFFFCC", "#FFBF00", "#DF0101", "#0431B4", "#86B404"]
     if rel_freq:
-        w = [numpy.zeros_like(data) + 1. / len(numpy.concatenate(list1)) for data in list1]
-        counts = plt.hist(list1, bins=bin1, edgecolor='black', linewidth=1, weights=w,
-                          label=["FS=1", "FS=2", "FS=3", "FS=4", "FS=5-10", "FS>10"], rwidth=0.8,
-                          color=["#808080", "#FFFFCC", "#FFBF00", "#DF0101", "#0431B4", "#86B404"],
-                          stacked=True, alpha=1, align="left", range=(0, maximumX + 1))
+        heights = heights / nr_points
+        plotBars(heights, bins, labels, colors, edgecolor="black", linewidth=1)
         plt.ylim((0, 1.07))
         plt.ylabel("Relative Frequency", fontsize=14)
-        bins = counts[1]  # width of bins
-        counts = numpy.array(map(float, counts[0][5]))
+        counts = heights.sum(axis=0)  # height of the stacked bars
 
     else:
-        counts = plt.hist(list1, bins=bin1, edgecolor='black', linewidth=1,
-                          label=["FS=1", "FS=2", "FS=3", "FS=4", "FS=5-10", "FS>10"], rwidth=0.8,
-                          color=["#808080", "#FFFFCC", "#FFBF00", "#DF0101", "#0431B4", "#86B404"],
-                          stacked=True, alpha=1, align="left", range=(0, maximumX + 1))
+        plotBars(heights, bins, labels, colors, edgecolor="black", linewidth=1)
         maximumY = numpy.amax(p1)
         plt.ylim((0, maximumY * 1.2))
         plt.ylabel("Absolute Frequency", fontsize=14)
-        bins = counts[1]  # width of bins
-        counts = numpy.array(map(int, counts[0][5]))
+        counts = heights.sum(axis=0).astype(int)  # height of the stacked bars
 
     plt.legend(loc='upper right', fontsize=14, frameon=True, bbox_to_anchor=(1.45, 1))
     plt.suptitle(subtitle, y=1, x=0.5, fontsize=14)
@@ -137,6 +157,10 @@ def plotHDwithFSD(list1, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, rel
     plt.grid(b=True, which='major', color='#424242', linestyle=':')
     plt.xlim((minimumX - step, maximumX + step))
     plt.xticks(numpy.arange(0, maximumX + step, step))
+    if max_td > 0 and maximumX == max_td + 1:  # all TDs above max_td are in the last bin
+        ticks1 = range(0, maximumX + 1)
+        ticks1[len(ticks1) - 1] = ">{}".format(max_td)
+        plt.xticks(range(0, maximumX + 1), ticks1)
 
     if nr_above_bars:
         bin_centers = -0.4 * numpy.diff(bins) + bins[:-1]
@@ -145,59 +169,60 @@ def plotHDwithFSD(list1, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, rel
                 continue
             else:
                 if rel_freq:
-                    plt.annotate("{:,}\n{:.3f}".format(int(round(x_label * len(numpy.concatenate(list1)))),
+                    plt.annotate("{:,}\n{:.3f}".format(int(round(x_label * nr_points)),
                                                        float(x_label)),
-                                 xy=(label, x_label + len(numpy.concatenate(list1)) * 0.0001),
+                                 xy=(label, x_label + nr_points * 0.0001),
                                  xycoords="data", color="#000066", fontsize=10)
                 else:
                     plt.annotate("{:,}\n{:.3f}".format(x_label, float(x_label) / sum(counts)),
-                                 xy=(label, x_label + len(numpy.concatenate(list1)) * 0.01),
+                                 xy=(label, x_label + nr_points * 0.01),
                                  xycoords="data", color="#000066", fontsize=10)
 
     if nr_unique_chimeras != 0:
         if (relative and ((counts[len(counts) - 1] / nr_unique_chimeras) == 2)) or \
                 (sum(counts) / nr_unique_chimeras) == 2:
             legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}\nnr. of CF = {:,} ({:,})"\
-                .format(lenTags, len_sample, len(numpy.concatenate(list1)), nr_unique_chimeras, nr_unique_chimeras * 2)
+                .format(lenTags, len_sample, nr_points, nr_unique_chimeras, nr_unique_chimeras * 2)
         else:
             legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}\nnr. of CF = {:,}".format(
-                lenTags, len_sample, len(numpy.concatenate(list1)), nr_unique_chimeras)
+                lenTags, len_sample, nr_points, nr_unique_chimeras)
     else:
         legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}".format(
-            lenTags, len_sample, len(numpy.concatenate(list1)))
+            lenTags, len_sample, nr_points)
 
     plt.text(0.14, -0.07, legend, size=12, transform=plt.gcf().transFigure)
+    if stratified:
+        plotStratifiedNote()
     pdf.savefig(fig, bbox_inches="tight")
     plt.close("all")
     plt.clf()
 
 
-def plotHDwithDCS(list1, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, relative=False,
-                  nr_above_bars=True, nr_unique_chimeras=0, len_sample=0, rel_freq=False):
+def plotHDwithDCS(table, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, relative=False,
+                  nr_above_bars=True, nr_unique_chimeras=0, len_sample=0, rel_freq=False, stratified=False):
     step = 1
     fig = plt.figure(figsize=(6, 8))
     plt.subplots_adjust(bottom=0.1)
-    p1 = numpy.array([v for k, v in sorted(Counter(numpy.concatenate(list1)).iteritems())])
+    uniqueHD, count = table
+    p1 = count.sum(axis=1)
+    nr_points = int(count.sum())
     maximumY = numpy.amax(p1)
     bin1 = maximumX + 1
+    heights, bins = binTable(table, bin1, (0, maximumX + 1))
+    labels = ["DCS", "ab", "ba"]
+    colors = ["#FF0000", "#5FB404", "#FFBF00"]
     if rel_freq:
-        w = [numpy.zeros_like(data) + 1. / len(numpy.concatenate(list1)) for data in list1]
-        counts = plt.hist(list1, bins=bin1, edgecolor='black', linewidth=1, weights=w,
-                          label=["DCS", "ab", "ba"], rwidth=0.8, color=["#FF0000", "#5FB404", "#FFBF00"],
-                          stacked=True, alpha=1, align="left", range=(0, maximumX + 1))
+        heights = heights / nr_points
+        plotBars(heights, bins, labels, colors, edgecolor="black", linewidth=1)
         plt.ylim((0, 1.07))
         plt.ylabel("Relative Frequency", fontsize=14)
-        bins = counts[1]  # width of bins
-        counts = numpy.array(map(float, counts[0][2]))
+        counts = heights.sum(axis=0)  # height of the stacked bars
 
     else:
-        counts = plt.hist(list1, bins=bin1, edgecolor='black', linewidth=1,
-                          label=["DCS", "ab", "ba"], rwidth=0.8, color=["#FF0000", "#5FB404", "#FFBF00"],
-                          stacked=True, alpha=1, align="left", range=(0, maximumX + 1))
+        plotBars(heights, bins, labels, colors, edgecolor="black", linewidth=1)
         plt.ylim((0, maximumY * 1.2))
         plt.ylabel("Absolute Frequency", fontsize=14)
-        bins = counts[1]  # width of bins
-        counts = numpy.array(map(int, counts[0][2]))
+        counts = heights.sum(axis=0).astype(int)  # height of the stacked bars
 
     plt.legend(loc='upper right', fontsize=14, frameon=True, bbox_to_anchor=(1.45, 1))
     plt.suptitle(subtitle, y=1, x=0.5, fontsize=14)
@@ -213,64 +238,63 @@ def plotHDwithDCS(list1, maximumX, minimumX, subtitle, lenTags, pdf, xlabel, rel
                 continue
             else:
                 if rel_freq:
-                    plt.annotate("{:,}\n{:.3f}".format(int(round(x_label * len(numpy.concatenate(list1)))),
+                    plt.annotate("{:,}\n{:.3f}".format(int(round(x_label * nr_points)),
                                                        float(x_label)),
-                                 xy=(label, x_label + len(numpy.concatenate(list1)) * 0.0001),
+                                 xy=(label, x_label + nr_points * 0.0001),
                                  xycoords="data", color="#000066", fontsize=10)
                 else:
                     plt.annotate("{:,}\n{:.3f}".format(x_label, float(x_label) / sum(counts)),
-                                 xy=(label, x_label + len(numpy.concatenate(list1)) * 0.01),
+                                 xy=(label, x_label + nr_points * 0.01),
                                  xycoords="data", color="#000066", fontsize=10)
 
     if nr_unique_chimeras != 0:
         if (sum(counts) / nr_unique_chimeras) == 2:
             legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}\nnr. of CF = {:,} ({:,})".\
-                format(lenTags, len_sample, len(numpy.concatenate(list1)), nr_unique_chimeras, nr_unique_chimeras * 2)
+                format(lenTags, len_sample, nr_points, nr_unique_chimeras, nr_unique_chimeras * 2)
         else:
             legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}\nnr. of CF = {:,}".format(
-                lenTags, len_sample, len(numpy.concatenate(list1)), nr_unique_chimeras)
+                lenTags, len_sample, nr_points, nr_unique_chimeras)
     else:
         legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}".format(
-            lenTags, len_sample, len(numpy.concatenate(list1)))
+            lenTags, len_sample, nr_points)
     plt.text(0.14, -0.07, legend, size=12, transform=plt.gcf().transFigure)
 
+    sumCol = count.sum(axis=0).astype(int)
     legend2 = "SSCS ab = {:,} ({:.5f})\nSSCS ba = {:,} ({:.5f})\nDCS = {:,} ({:.5f})".format(
-        len(list1[1]), len(list1[1]) / float(nr_unique_chimeras),
-        len(list1[2]), len(list1[2]) / float(nr_unique_chimeras),
-        len(list1[0]), len(list1[0]) / float(nr_unique_chimeras))
+        sumCol[1], sumCol[1] / float(nr_unique_chimeras),
+        sumCol[2], sumCol[2] / float(nr_unique_chimeras),
+        sumCol[0], sumCol[0] / float(nr_unique_chimeras))
     plt.text(0.6, -0.047, legend2, size=12, transform=plt.gcf().transFigure)
+    if stratified:
+        plotStratifiedNote()
 
     pdf.savefig(fig, bbox_inches="tight")
     plt.close("all")
     plt.clf()
 
 
-def plotHDwithinSeq(sum1, sum1min, sum2, sum2min, min_value, lenTags, pdf, len_sample, rel_freq=False):
+def plotHDwithinSeq(table, lenTags, pdf, len_sample, rel_freq=False, stratified=False):
     fig = plt.figure(figsize=(6, 8))
     plt.subplots_adjust(bottom=0.1)
 
-    ham_partial = [sum1, sum1min, sum2, sum2min, numpy.array(min_value)]  # new hd within tags
-    maximumX = numpy.amax(numpy.concatenate(ham_partial))
-    minimumX = numpy.amin(numpy.concatenate(ham_partial))
+    uniqueHD, count = table  # new hd within tags
+    maximumX = numpy.amax(uniqueHD)
+    minimumX = numpy.amin(uniqueHD)
 
     if len(range(minimumX, maximumX)) == 0:
-        range1 = minimumX
+        heights, edges = binTable(table, minimumX, (minimumX, maximumX))
     else:
-        range1 = range(minimumX, maximumX + 2)
+        heights, edges = binTable(table, range(minimumX, maximumX + 2))
 
+    labels = ["TD a.min", "TD b.max", "TD b.min", "TD a.max", "TD a.min + b.max,\nTD a.max + b.min"]
+    colors = ["#58ACFA", "#0404B4", "#FE642E", "#B40431", "#585858"]
     if rel_freq:
-        w = [numpy.zeros_like(data) + 1. / len(data) for data in ham_partial]
-        plt.hist(ham_partial, align="left", rwidth=0.8, stacked=False, weights=w,
-                 label=["TD a.min", "TD b.max", "TD b.min", "TD a.max", "TD a.min + b.max,\nTD a.max + b.min"],
-                 bins=range1, color=["#58ACFA", "#0404B4", "#FE642E", "#B40431", "#585858"],
-                 edgecolor='black', linewidth=1)
+        heights = heights / numpy.maximum(count.sum(axis=0), 1)[:, numpy.newaxis]  # relative to each column
+        plotBars(heights, edges, labels, colors, stacked=False, edgecolor="black", linewidth=1)
         plt.ylabel("Relative Frequency", fontsize=14)
         plt.ylim(0, 1.07)
     else:
-        plt.hist(ham_partial, align="left", rwidth=0.8, stacked=False,
-                 label=["TD a.min", "TD b.max", "TD b.min", "TD a.max", "TD a.min + b.max,\nTD a.max + b.min"],
-                 bins=range1, color=["#58ACFA", "#0404B4", "#FE642E", "#B40431", "#585858"],
-                 edgecolor='black', linewidth=1)
+        plotBars(heights, edges, labels, colors, stacked=False, edgecolor="black", linewidth=1)
         plt.ylabel("Absolute Frequency", fontsize=14)
 
     plt.legend(loc='upper right', fontsize=14, frameon=True, bbox_to_anchor=(1.6, 1))
@@ -280,69 +304,61 @@ def plotHDwithinSeq(sum1, sum1min, sum2, sum2min, min_value, lenTags, pdf, len_s
     plt.xlim((minimumX - 1, maximumX + 1))
     plt.xticks(numpy.arange(0, maximumX + 1, 1.0))
     legend = "nr. of tags = {:,}\nsample size = {:,}\nnr. of data points = {:,}".format(
-        lenTags, len_sample, len(numpy.concatenate(ham_partial)))
+        lenTags, len_sample, int(count.sum()))
     plt.text(0.14, -0.05, legend, size=12, transform=plt.gcf().transFigure)
+    if stratified:
+        plotStratifiedNote()
     pdf.savefig(fig, bbox_inches="tight")
     plt.close("all")
     plt.clf()
 
 
-def createTableFSD2(list1, diff=True):
-    selfAB = numpy.concatenate(list1)
-    uniqueFS = numpy.unique(selfAB)
-    nr = numpy.arange(0, len(uniqueFS), 1)
-    if diff is False:
-        count = numpy.zeros((len(uniqueFS), 6))
+def contingencyTable(values, category, nr_categories):
+    # counts of each value (rows) in each category (columns) as one 2D bincount, values with category -1 are left out
+    values = numpy.asarray(values)
+    keep = category >= 0
+    uniqueValues, rows = numpy.unique(values[keep], return_inverse=True)
+    count = numpy.bincount(rows * nr_categories + category[keep], minlength=len(uniqueValues) * nr_categories)
+    return (uniqueValues, count.reshape(len(uniqueValues), nr_categories).astype(float))
+
+
+def tableOfLists(list1):
+    # contingency table of the values of each list (columns)
+    category = numpy.repeat(numpy.arange(len(list1)), [len(i) for i in list1])
+    return contingencyTable(numpy.concatenate(list1), category, len(list1))
+
+
+def binTable(table, bins, bin_range=None):
+    # heights of the bars of each column in the bins of plt.hist, the unique values are binned with their counts
+    values, count = table
+    heights = []
+    for i in range(count.shape[1]):
+        height, edges = numpy.histogram(values, bins=bins, range=bin_range, weights=count[:, i])
+        heights.append(height)
+    return (numpy.array(heights), edges)
+
+
+def plotBars(heights, edges, labels, colors, stacked=True, rwidth=0.8, **kwargs):
+    # bars of the binned counts placed like those of plt.hist with align="left"
+    width = rwidth * numpy.diff(edges)
+    if stacked:
+        offset, step = 0.0, 0.0
     else:
-        count = numpy.zeros((len(uniqueFS), 7))
-    state = 1
-    for i in list1:
-        counts = list(Counter(i).items())
-        hd = [item[0] for item in counts]
-        c = [item[1] for item in counts]
-        table = numpy.column_stack((hd, c))
-        if len(table) == 0:
-            state = state + 1
-            continue
-        else:
-            if state == 1:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 0] = j[1]
-            if state == 2:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 1] = j[1]
-            if state == 3:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 2] = j[1]
-            if state == 4:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 3] = j[1]
-            if state == 5:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 4] = j[1]
-            if state == 6:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 5] = j[1]
-            if state == 7:
-                for k, l in zip(uniqueFS, nr):
-                    for j in table:
-                        if j[0] == uniqueFS[l]:
-                            count[l, 6] = j[1]
-            state = state + 1
-        sumRow = count.sum(axis=1)
-        sumCol = count.sum(axis=0)
+        offset = -0.5 * width * (1 - 1. / len(heights))
+        width = width / len(heights)
+        step = width
+    bottom = numpy.zeros(len(edges) - 1)
+    for height, label, color in zip(heights, labels, colors):
+        plt.bar(edges[:-1] + offset, height, width, bottom=bottom, align="center", color=color, label=label, **kwargs)
+        if stacked:
+            bottom = bottom + height
+        offset = offset + step
+
+
+def createTableFSD2(table):
+    uniqueFS, count = table
+    sumRow = count.sum(axis=1)
+    sumCol = count.sum(axis=0)
     uniqueFS = uniqueFS.astype(str)
     if uniqueFS[len(uniqueFS) - 1] == "20":
         uniqueFS[len(uniqueFS) - 1] = ">20"
@@ -379,142 +395,30 @@ def createFileFSD2(summary, sumCol, overallSum, output_file, name, sep, rel=Fals
     output_file.write("\n\n")
 
 
-def createTableHD(list1, row_label):
-    selfAB = numpy.concatenate(list1)
-    uniqueHD = numpy.unique(selfAB)
-    nr = numpy.arange(0, len(uniqueHD), 1)
-    count = numpy.zeros((len(uniqueHD), 6))
-    state = 1
-    for i in list1:
-        counts = list(Counter(i).items())
-        hd = [item[0] for item in counts]
-        c = [item[1] for item in counts]
-        table = numpy.column_stack((hd, c))
-        if len(table) == 0:
-            state = state + 1
-            continue
-        else:
-            if state == 1:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 0] = j[1]
-            if state == 2:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 1] = j[1]
-            if state == 3:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 2] = j[1]
-            if state == 4:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 3] = j[1]
-            if state == 5:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 4] = j[1]
-            if state == 6:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 5] = j[1]
-            state = state + 1
-        sumRow = count.sum(axis=1)
-        sumCol = count.sum(axis=0)
-        first = ["{}{}".format(row_label, i) for i in uniqueHD]
-        final = numpy.column_stack((first, count, sumRow))
+def createTableHD(table, row_label):
+    uniqueHD, count = table
+    sumRow = count.sum(axis=1)
+    sumCol = count.sum(axis=0)
+    first = ["{}{}".format(row_label, i) for i in uniqueHD]
+    final = numpy.column_stack((first, count, sumRow))
     return (final, sumCol)
 
 
-def createTableHDwithTags(list1):
-    selfAB = numpy.concatenate(list1)
-    uniqueHD = numpy.unique(selfAB)
-    nr = numpy.arange(0, len(uniqueHD), 1)
-    count = numpy.zeros((len(uniqueHD), 5))
-    state = 1
-    for i in list1:
-        counts = list(Counter(i).items())
-        hd = [item[0] for item in counts]
-        c = [item[1] for item in counts]
-        table = numpy.column_stack((hd, c))
-        if len(table) == 0:
-            state = state + 1
-            continue
-        else:
-            if state == 1:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 0] = j[1]
-            if state == 2:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 1] = j[1]
-            if state == 3:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 2] = j[1]
-            if state == 4:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 3] = j[1]
-            if state == 5:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 4] = j[1]
-            state = state + 1
-        sumRow = count.sum(axis=1)
-        sumCol = count.sum(axis=0)
-        first = ["TD={}".format(i) for i in uniqueHD]
-        final = numpy.column_stack((first, count, sumRow))
+def createTableHDwithTags(table):
+    uniqueHD, count = table
+    sumRow = count.sum(axis=1)
+    sumCol = count.sum(axis=0)
+    first = ["TD={}".format(i) for i in uniqueHD]
+    final = numpy.column_stack((first, count, sumRow))
     return (final, sumCol)
 
 
-def createTableHDwithDCS(list1):
-    selfAB = numpy.concatenate(list1)
-    uniqueHD = numpy.unique(selfAB)
-    nr = numpy.arange(0, len(uniqueHD), 1)
-    count = numpy.zeros((len(uniqueHD), len(list1)))
-    state = 1
-    for i in list1:
-        counts = list(Counter(i).items())
-        hd = [item[0] for item in counts]
-        c = [item[1] for item in counts]
-        table = numpy.column_stack((hd, c))
-        if len(table) == 0:
-            state = state + 1
-            continue
-        else:
-            if state == 1:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 0] = j[1]
-            if state == 2:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 1] = j[1]
-            if state == 3:
-                for k, l in zip(uniqueHD, nr):
-                    for j in table:
-                        if j[0] == uniqueHD[l]:
-                            count[l, 2] = j[1]
-            state = state + 1
-        sumRow = count.sum(axis=1)
-        sumCol = count.sum(axis=0)
-        first = ["TD={}".format(i) for i in uniqueHD]
-        final = numpy.column_stack((first, count, sumRow))
+def createTableHDwithDCS(table):
+    uniqueHD, count = table
+    sumRow = count.sum(axis=1)
+    sumCol = count.sum(axis=0)
+    first = ["TD={}".format(i) for i in uniqueHD]
+    final = numpy.column_stack((first, count, sumRow))
     return (final, sumCol)
 
 
@@ -576,107 +480,744 @@ def createFileHDwithinTag(summary, sumCol, overallSum, output_file, name, sep):
     output_file.write("\n\n")
 
 
-def hamming(array1, array2):
-    res = 99 * numpy.ones(len(array1))
-    i = 0
-    array2 = numpy.unique(array2)  # remove duplicate sequences to decrease running time
-    for a in array1:
-        dist = numpy.array([sum(itertools.imap(operator.ne, a, b)) for b in array2])  # fastest
-        res[i] = numpy.amin(dist[dist > 0])  # pick min distance greater than zero
-        i += 1
-    return res
-
-
-def hamming_difference(array1, array2, mate_b):
-    array2 = numpy.unique(array2)  # remove duplicate sequences to decrease running time
-    array1_half = numpy.array([i[0:(len(i)) / 2] for i in array1])  # mate1 part1
-    array1_half2 = numpy.array([i[len(i) / 2:len(i)] for i in array1])  # mate1 part 2
-    array2_half = numpy.array([i[0:(len(i)) / 2] for i in array2])  # mate2 part1
-    array2_half2 = numpy.array([i[len(i) / 2:len(i)] for i in array2])  # mate2 part2
-
-    diff11 = []
-    relativeDiffList = []
-    ham1 = []
-    ham2 = []
-    ham1min = []
-    ham2min = []
-    min_valueList = []
-    min_tagsList = []
-    diff11_zeros = []
-    min_tagsList_zeros = []
-    max_tag_list = []
-    i = 0  # counter, only used to see how many HDs of tags were already calculated
-    if mate_b is False:  # HD calculation for all a's
-        half1_mate1 = array1_half
-        half2_mate1 = array1_half2
-        half1_mate2 = array2_half
-        half2_mate2 = array2_half2
-    elif mate_b is True:  # HD calculation for all b's
-        half1_mate1 = array1_half2
-        half2_mate1 = array1_half
-        half1_mate2 = array2_half2
-        half2_mate2 = array2_half
-
-    for a, b, tag in zip(half1_mate1, half2_mate1, array1):
-        # exclude identical tag from array2, to prevent comparison to itself
-        sameTag = numpy.where(array2 == tag)[0]
-        indexArray2 = numpy.arange(0, len(array2), 1)
-        index_withoutSame = numpy.delete(indexArray2, sameTag)  # delete identical tag from the data
-
-        # all tags without identical tag
-        array2_half_withoutSame = half1_mate2[index_withoutSame]
-        array2_half2_withoutSame = half2_mate2[index_withoutSame]
-        array2_withoutSame = array2[index_withoutSame]  # whole tag (=not splitted into 2 halfs)
-        # calculate HD of "a" in the tag to all "a's" or "b" in the tag to all "b's"
-        dist = numpy.array([sum(itertools.imap(operator.ne, a, c)) for c in
-                            array2_half_withoutSame])
-        min_index = numpy.where(dist == dist.min())[0]  # get index of min HD
-        min_value = dist.min()
-        # get all "b's" of the tag or all "a's" of the tag with minimum HD
-        min_tag_half2 = array2_half2_withoutSame[min_index]
-        min_tag_array2 = array2_withoutSame[min_index]  # get whole tag with min HD
-
-        dist_second_half = numpy.array([sum(itertools.imap(operator.ne, b, e)) for e in
-                                        min_tag_half2])  # calculate HD of "b" to all "b's" or "a" to all "a's"
-        max_value = dist_second_half.max()
-        max_index = numpy.where(dist_second_half == dist_second_half.max())[0]  # get index of max HD
-        max_tag = min_tag_array2[max_index]
-
-        # for d, d2 in zip(min_value, max_value):
-        if mate_b is True:  # half2, corrects the variable of the HD from both halfs if it is a or b
-            ham2.append(min_value)
-            ham2min.append(max_value)
-        else:  # half1, corrects the variable of the HD from both halfs if it is a or b
-            ham1.append(min_value)
-            ham1min.append(max_value)
-
-        min_valueList.append(min_value + max_value)
-        min_tagsList.append(tag)
-        difference1 = abs(min_value - max_value)
-        diff11.append(difference1)
-        rel_difference = round(float(difference1) / (min_value + max_value), 1)
-        relativeDiffList.append(rel_difference)
-
-        # tags which have identical parts:
-        if min_value == 0 or max_value == 0:
-            min_tagsList_zeros.append(numpy.array(tag))
-            difference1_zeros = abs(min_value - max_value)  # td of non-identical part
-            diff11_zeros.append(difference1_zeros)
-            max_tag_list.append(numpy.array(max_tag))
+# 2-bit codes of the bases, tags with other characters are removed before the TD analysis
+BASE_CODES = numpy.zeros(256, dtype=numpy.uint8)
+BASE_CODES[[ord("A"), ord("C"), ord("G"), ord("T")]] = [0, 1, 2, 3]
+BASES = numpy.array([ord("A"), ord("C"), ord("G"), ord("T")], dtype=numpy.uint8)
+BASES_PER_WORD = 32
+
+# characters of the tags: 0 = base, 1 = N, 2 = any other character, 3 = padding of a tag that is shorter than the
+# widest tag of the fixed-width tag column
+TAG_CHARACTERS = numpy.full(256, 2, dtype=numpy.uint8)
+TAG_CHARACTERS[[ord("A"), ord("C"), ord("G"), ord("T")]] = 0
+TAG_CHARACTERS[ord("N")] = 1
+TAG_CHARACTERS[0] = 3
+
+# segment length of the multi-index and max. expected fraction of the tags among the candidates of a tag,
+# the nr. of substitutions per segment is increased as long as the probing stays below it (see max_sub_radius)
+SEGMENT_LENGTH = 6
+MAX_CANDIDATE_FRACTION = 0.5
+
+# nr. of sampled tags per task of the worker processes and seconds between the progress reports
+TD_CHUNK_SIZE = 64
+PROGRESS_INTERVAL = 10
+
+# max. nr. of tags in a leaf of the BK-tree and nr. of tags that are searched together
+BK_LEAF_SIZE = 1024
+BK_QUERY_BATCH = 256
+
+# constants for counting the mismatches of packed tags
+ONE = numpy.uint64(1)
+LOW_BITS = numpy.uint64(0x5555555555555555)
+M2 = numpy.uint64(0x3333333333333333)
+M4 = numpy.uint64(0x0f0f0f0f0f0f0f0f)
+H01 = numpy.uint64(0x0101010101010101)
+SHIFT_POPCOUNT = numpy.uint64(56)
+
+
+def tag_codes(tags):
+    # fixed-width byte view of the tags: one row per tag, one column per base
+    tags = numpy.ascontiguousarray(tags)
+    if tags.dtype.kind != "S":
+        tags = tags.astype(numpy.string_)
+    length = len(tags[0]) if len(tags) != 0 else 0
+    if length == 0:
+        return numpy.zeros((len(tags), 0), dtype=numpy.uint8)
+    byte_view = tags.view(numpy.uint8).reshape(len(tags), tags.dtype.itemsize)
+    return BASE_CODES[byte_view[:, :length]]
+
+
+def validate_tags(tags):
+    # mask of the tags with only A, C, G, T and the length of the widest tag, and the nr. of tags with N, with any
+    # other character and of shorter tags
+    tags = numpy.ascontiguousarray(tags)
+    if tags.dtype.kind != "S":
+        tags = tags.astype(numpy.string_)
+    byte_view = tags.view(numpy.uint8).reshape(len(tags), tags.dtype.itemsize)
+    used_columns = numpy.flatnonzero(byte_view.any(axis=0))
+    characters = TAG_CHARACTERS[byte_view[:, :used_columns[-1] + 1 if len(used_columns) != 0 else 0]]
+    with_n = (characters == 1).any(axis=1)
+    with_other = (characters == 2).any(axis=1)
+    shorter = (characters == 3).any(axis=1)
+    counts = {"N": numpy.count_nonzero(with_n), "other": numpy.count_nonzero(with_other),
+              "shorter": numpy.count_nonzero(shorter)}
+    return ~(with_n | with_other | shorter), counts
+
+
+def subset_columns(length, subset):
+    # positions of the shortened tag: the middle subset bases of both halves of the tag
+    half = length / 2
+    flanking_region_float = float((half - subset)) / 2
+    flanking_region = int(flanking_region_float)
+    if flanking_region_float % 2 == 0:
+        flanking_region_end = flanking_region
+    else:
+        flanking_region_end = half - subset - flanking_region
+    columns_a = numpy.arange(half)[flanking_region:half - flanking_region_end]
+    columns_b = numpy.arange(half, length)[flanking_region:length - half - flanking_region_end]
+    return numpy.concatenate((columns_a, columns_b))
+
+
+def shorten_tags(tags, columns):
+    # the selected positions are copied from the fixed-width byte view of the tags into one new tag column
+    tags = numpy.ascontiguousarray(tags)
+    if tags.dtype.kind != "S":
+        tags = tags.astype(numpy.string_)
+    byte_view = tags.view(numpy.uint8).reshape(len(tags), tags.dtype.itemsize)
+    shortened = numpy.ascontiguousarray(byte_view[:, columns])
+    return shortened.view("S{}".format(max(1, len(columns)))).ravel()
+
+
+def pack_codes(codes):
+    # 2 bits per base, 32 bases per uint64 word (= 48 bits for a tag with 24 bases)
+    nr_words = max(1, (codes.shape[1] + BASES_PER_WORD - 1) // BASES_PER_WORD)
+    words = numpy.zeros((len(codes), nr_words), dtype=numpy.uint64)
+    for pos in range(codes.shape[1]):
+        shift = numpy.uint64(2 * (pos % BASES_PER_WORD))
+        words[:, pos // BASES_PER_WORD] |= codes[:, pos].astype(numpy.uint64) << shift
+    return words
+
+
+def unpack_tags(words, length):
+    # tags of the packed words of pack_codes as one fixed-width tag column
+    codes = numpy.zeros((len(words), max(1, length)), dtype=numpy.uint8)
+    for pos in range(length):
+        shift = numpy.uint64(2 * (pos % BASES_PER_WORD))
+        codes[:, pos] = (words[:, pos // BASES_PER_WORD] >> shift) & numpy.uint64(3)
+    return numpy.ascontiguousarray(BASES[codes]).view("S{}".format(codes.shape[1])).ravel()
+
+
+def mismatch_bits(words, query):
+    # xor of the packed tags, the low bit of a base is set if the bases differ
+    x = words ^ query
+    return (x | (x >> ONE)) & LOW_BITS
+
+
+def count_mismatches(bits, dtype=int):
+    # popcount of the words, computed in place: bits is overwritten
+    x = bits >> numpy.uint64(2)
+    x &= M2
+    bits &= M2
+    x += bits
+    x += x >> numpy.uint64(4)
+    x &= M4
+    x *= H01
+    x >>= SHIFT_POPCOUNT
+    if x.shape[-1] == 1:
+        return x[..., 0].astype(dtype)
+    return x.sum(axis=-1, dtype=dtype)
+
+
+def tag_distance(words, query):
+    # TD of one packed tag to all packed tags
+    return count_mismatches(mismatch_bits(words, query))
+
+
+def half_masks(length, nr_words):
+    # low bits of the bases in the first (a) and in the second half (b) of the packed tag
+    masks = numpy.zeros((2, nr_words), dtype=numpy.uint64)
+    for pos in range(length):
+        masks[int(pos >= length // 2), pos // BASES_PER_WORD] |= ONE << numpy.uint64(2 * (pos % BASES_PER_WORD))
+    return masks[0], masks[1]
+
+
+def half_distances(words, query, mask_a, mask_b):
+    bits = mismatch_bits(words, query)
+    return count_mismatches(bits & mask_a), count_mismatches(bits & mask_b)
+
+
+def segment_bounds(start, end):
+    if end <= start:
+        return []
+    nr_segments = max(1, (end - start) // SEGMENT_LENGTH, -(-(end - start) // BASES_PER_WORD))
+    bounds = numpy.linspace(start, end, nr_segments + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def build_segment_index(codes):
+    # multi-index hashing: both halves of the tags are split into segments and each segment is sorted by its packed key,
+    # two tags with TD <= r (in one half) have at least one segment (in this half) with TD <= r / nr. of segments
+    half = codes.shape[1] // 2
+    index = []
+    for start, end in segment_bounds(0, half) + segment_bounds(half, codes.shape[1]):
+        keys = pack_codes(codes[:, start:end])[:, 0]
+        order = numpy.argsort(keys, kind="mergesort")
+        index.append((start, end, keys[order], order))
+    return index
+
+
+def segment_keys(index, codes):
+    return numpy.column_stack([pack_codes(codes[:, start:end])[:, 0] for start, end, keys, order in index])
+
+
+# bit masks of all substitutions of a segment by length and nr. of substituted bases
+SUBSTITUTION_MASKS = {}
+
+
+def segment_variants(key, length, sub_radius):
+    # all keys of a segment with exactly sub_radius substituted bases
+    if (length, sub_radius) not in SUBSTITUTION_MASKS:
+        masks = []
+        for positions in itertools.combinations(range(length), sub_radius):
+            for deltas in itertools.product((1, 2, 3), repeat=sub_radius):
+                masks.append(sum(delta << (2 * pos) for pos, delta in zip(positions, deltas)))
+        SUBSTITUTION_MASKS[length, sub_radius] = numpy.array(masks, dtype=numpy.uint64)
+    return numpy.uint64(key) ^ SUBSTITUTION_MASKS[length, sub_radius]
+
+
+def max_sub_radius(index):
+    # max. nr. of substitutions per segment, so that the expected fraction of random tags with a probed key in any
+    # segment stays below MAX_CANDIDATE_FRACTION; a tag that is not settled with it is compared to all tags
+    sub_radius = 0
+    while True:
+        fraction = sum(sum(len(segment_variants(0, end - start, r)) for r in range(sub_radius + 2)) /
+                       4. ** (end - start) for start, end, keys, order in index)
+        if fraction >= MAX_CANDIDATE_FRACTION:
+            return sub_radius
+        sub_radius += 1
+
+
+def segment_candidates(index, query_keys, sub_radius):
+    candidates = []
+    for (start, end, keys, order), key in zip(index, query_keys):
+        variants = segment_variants(int(key), end - start, sub_radius)
+        lower = numpy.searchsorted(keys, variants, side="left")
+        upper = numpy.searchsorted(keys, variants, side="right")
+        candidates.extend(order[lo:up] for lo, up in zip(lower, upper) if up > lo)
+    if len(candidates) == 0:
+        return numpy.array([], dtype=int)
+    return numpy.unique(numpy.concatenate(candidates))
+
+
+def half_keys(codes):
+    # exact key of each half of the tags: the packed half if it fits into one word, otherwise the bytes of the codes
+    half = codes.shape[1] // 2
+    keys = []
+    for start, end in ((0, half), (half, codes.shape[1])):
+        if end - start <= BASES_PER_WORD:
+            keys.append(pack_codes(codes[:, start:end])[:, 0])
+        else:
+            keys.append(numpy.ascontiguousarray(codes[:, start:end]).view(numpy.dtype((numpy.void, end - start))).ravel())
+    return keys
+
+
+def build_half_index(codes):
+    # tags with an identical half a or b (= chimeras) are found by a binary search in the sorted keys of the halves
+    index = []
+    for keys in half_keys(codes):
+        order = numpy.argsort(keys, kind="mergesort")
+        index.append((keys[order], order))
+    return index
+
+
+def half_matches(half_index, query_keys, self_row):
+    # other tags with the same half a and with the same half b as the tag
+    matches = []
+    for (keys, order), key in zip(half_index, query_keys):
+        rows = order[numpy.searchsorted(keys, key, side="left"):numpy.searchsorted(keys, key, side="right")]
+        matches.append(rows[rows != self_row])
+    return matches
+
+
+def all_distances(words, query_words, mask_a, mask_b, self_row):
+    # TDs of both halves to all tags, the tag itself gets TDs larger than any real TD instead of being removed
+    dist_a, dist_b = half_distances(words, query_words, mask_a, mask_b)
+    if self_row >= 0:
+        dist_a[self_row] = dist_b[self_row] = words.shape[1] * BASES_PER_WORD + 1
+    return numpy.arange(len(words)), dist_a, dist_b
+
+
+def nearest_fused(index, words, query_words, query_keys, mask_a, mask_b, self_row, matches, whole_tag=True,
+                  max_td=0, sub_radius_limit=1):
+    # probe the segments with 0, 1, ..., sub_radius_limit substitutions until the min. TDs of the whole tag and of
+    # both halves are guaranteed to be among the candidates, otherwise the tag is compared to all tags;
+    # a half with an identical half in another tag has min. TD 0 and is always settled,
+    # the whole tag is settled as well if all tags within max_td are guaranteed to be among the candidates
+    half = index[-1][1] // 2
+    nr_segments_a = sum(end <= half for start, end, keys, order in index)
+    nr_segments = numpy.array([len(index), nr_segments_a, len(index) - nr_segments_a])
+    candidates = numpy.concatenate(matches)
+    for sub_radius in range(sub_radius_limit + 1):
+        candidates = numpy.union1d(candidates, segment_candidates(index, query_keys, sub_radius))
+        other = candidates[candidates != self_row]  # exclude identical tag
+        if len(other) != 0:
+            dist_a, dist_b = half_distances(words[other], query_words, mask_a, mask_b)
+            radius = (sub_radius + 1) * nr_segments - 1
+            if (not whole_tag or (dist_a + dist_b).min() <= radius[0] or 0 < max_td <= radius[0]) and \
+                    (len(matches[0]) != 0 or dist_a.min() <= radius[1]) and \
+                    (len(matches[1]) != 0 or dist_b.min() <= radius[2]):
+                return other, dist_a, dist_b
+    return all_distances(words, query_words, mask_a, mask_b, self_row)
+
+
+def build_bk_tree(words):
+    # BK-tree: the children of a node are grouped by their TD to the pivot tag, small subtrees are kept as leaves
+    tree = [None]
+    stack = [(tree, 0, numpy.arange(len(words)))]
+    while len(stack) != 0:
+        parent, key, indices = stack.pop()
+        if len(indices) <= BK_LEAF_SIZE:
+            node = indices
+        else:
+            pivot = indices[0]
+            rest = indices[1:]
+            dist = tag_distance(words[rest], words[pivot])
+            order = numpy.argsort(dist, kind="mergesort")
+            values, starts = numpy.unique(dist[order], return_index=True)
+            node = (pivot, {})
+            for d, child in zip(values, numpy.split(rest[order], starts[1:])):
+                stack.append((node[1], d, child))
+        parent[key] = node
+    return tree[0]
+
+
+def bk_tree_nearest(tree, words, queries, max_td=0):
+    # nearest non-identical tag for a batch of tags, subtrees are skipped for all tags
+    # for which the triangle inequality rules out a smaller TD (or a TD <= max_td)
+    min_dist = numpy.repeat(max_td + 1 if max_td > 0 else words.shape[1] * BASES_PER_WORD + 1, len(queries))
+    stack = [(tree, numpy.arange(len(queries)), numpy.zeros(len(queries), dtype=int))]
+    while len(stack) != 0:
+        node, active, lower_bound = stack.pop()
+        active = active[lower_bound < min_dist[active]]
+        if len(active) == 0:
+            continue
+        if isinstance(node, numpy.ndarray):  # leaf
+            dist = tag_distance(words[node][None, :, :], queries[active][:, None, :])
+            dist[dist == 0] = min_dist.max()
+            min_dist[active] = numpy.minimum(min_dist[active], dist.min(axis=1))
+            continue
+        pivot, children = node
+        d = tag_distance(queries[active], words[pivot])
+        found = d > 0
+        min_dist[active[found]] = numpy.minimum(min_dist[active[found]], d[found])
+        median_d = numpy.median(d)
+        for child_d in sorted(children, key=lambda c: abs(c - median_d), reverse=True):  # closest subtree first
+            child_bound = numpy.abs(child_d - d)
+            inside = child_bound < min_dist[active]
+            if inside.any():
+                stack.append((children[child_d], active[inside], child_bound[inside]))
+    return min_dist
+
+
+def add_half_distances(result, tag, dist_half, dist_other, other, array2, mate_b):
+    # HD of "a" in the tag to all "a's" or "b" in the tag to all "b's"
+    min_value = dist_half.min()
+    min_index = numpy.where(dist_half == min_value)[0]  # get index of min HD
+    # HD of "b" to all "b's" or "a" to all "a's" of the tags with minimum HD
+    dist_second_half = dist_other[min_index]
+    max_value = dist_second_half.max()
+    max_tag = array2[other[min_index[dist_second_half == max_value]]]  # get whole tag with max HD
+    add_half_result(result, tag, min_value, max_value, max_tag, mate_b)
+
+
+def add_half_result(result, tag, min_value, max_value, max_tag, mate_b):
+    diff11, ham1, ham2, min_valueList, min_tagsList, relativeDiffList, diff11_zeros, \
+        min_tagsList_zeros, ham1min, ham2min, max_tag_list = result
+    if mate_b is True:  # half2, corrects the variable of the HD from both halfs if it is a or b
+        ham2.append(min_value)
+        ham2min.append(max_value)
+    else:  # half1, corrects the variable of the HD from both halfs if it is a or b
+        ham1.append(min_value)
+        ham1min.append(max_value)
+
+    min_valueList.append(min_value + max_value)
+    min_tagsList.append(tag)
+    difference1 = abs(min_value - max_value)
+    diff11.append(difference1)
+    rel_difference = round(float(difference1) / (min_value + max_value), 1)
+    relativeDiffList.append(rel_difference)
+
+    # tags which have identical parts:
+    if min_value == 0 or max_value == 0:
+        min_tagsList_zeros.append(numpy.array(tag))
+        difference1_zeros = abs(min_value - max_value)  # td of non-identical part
+        diff11_zeros.append(difference1_zeros)
+        max_tag_list.append(numpy.array(max_tag))
+    else:
+        min_tagsList_zeros.append(None)
+        diff11_zeros.append(None)
+        max_tag_list.append(None)
+
+
+def encode_reference(array2):
+    # the dataset is deduplicated and encoded once, the result can be reused for all analyses of the same tags;
+    # only the packed tags are kept, the byte codes are derived again from the tags for an index (index_reference)
+    tags = numpy.unique(array2)  # remove duplicate sequences to decrease running time
+    codes = tag_codes(tags)
+    reference = {"tags": tags, "words": pack_codes(codes)}
+    reference["mask_a"], reference["mask_b"] = half_masks(codes.shape[1], reference["words"].shape[1])
+    reference["half_index"] = build_half_index(codes)
+    for keys, order in reference["half_index"]:
+        keys.flags.writeable = False
+        order.flags.writeable = False
+    for key in ("tags", "words", "mask_a", "mask_b"):
+        reference[key].flags.writeable = False
+    return reference
+
+
+def index_reference(reference, engine="mih", max_td=0):
+    # the index of the engine is only built if the reference does not contain it yet,
+    # with max_td > 0 all min. TDs of the whole tag above max_td are reported as max_td + 1
+    reference["engine"] = engine
+    reference["max_td"] = max_td
+    if engine == "bktree" and "tree" not in reference:
+        reference["tree"] = build_bk_tree(reference["words"])
+    if engine in ("mih", "bktree") and "index" not in reference:
+        reference["index"] = build_segment_index(tag_codes(reference["tags"]))
+        for start, end, keys, order in reference["index"]:
+            keys.flags.writeable = False
+            order.flags.writeable = False
+    return reference
+
+
+def prepare_reference(array2, engine="mih", max_td=0):
+    # the dataset is deduplicated, encoded and indexed once in the main process
+    return index_reference(encode_reference(array2), engine, max_td)
+
+
+def reference_rows(reference, array1):
+    # row of the tags in the deduplicated dataset, -1 if the tag is not in the dataset
+    tags = reference["tags"]
+    rows = numpy.searchsorted(tags, array1)
+    rows[rows == len(tags)] = 0
+    rows[tags[rows] != array1] = -1
+    return rows
+
+
+# dataset of the TD analysis, the worker processes inherit it from the main process without copying
+REFERENCE = {}
+
+
+def share_reference(reference):
+    REFERENCE.clear()
+    REFERENCE.update(reference)
+
+
+# nr. of the reference in the persistent process pool of the batch mode
+REFERENCE_NR = itertools.count()
+# arrays of the reference with at least this nr. of bytes are memory-mapped by the processes of the persistent pool
+MAPPED_ARRAY_BYTES = 2 ** 16
+
+
+def dump_reference(reference, reference_file):
+    # the large arrays (tags, codes, words, indices) are written as records that all processes map without copying,
+    # the rest of the reference is pickled into the first record
+    arrays = []
+
+    def persistent_id(obj):
+        if isinstance(obj, numpy.ndarray) and obj.dtype.kind in "biufS" and obj.nbytes >= MAPPED_ARRAY_BYTES:
+            arrays.append(obj)
+            return str(len(arrays))
+        return None
+
+    pickled = StringIO()
+    pickler = cPickle.Pickler(pickled, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(reference)
+    write_arrays(reference_file, [numpy.frombuffer(pickled.getvalue(), dtype=numpy.uint8)] + arrays)
+
+
+def load_reference(reference_file, reference_nr):
+    # the processes of the persistent pool load the reference of the current dataset once
+    if REFERENCE.get("reference_nr") != reference_nr:
+        arrays = map_arrays(reference_file)
+        unpickler = cPickle.Unpickler(StringIO(arrays[0].tostring()))
+        unpickler.persistent_load = lambda nr: arrays[int(nr)]
+        share_reference(unpickler.load())
+        REFERENCE["reference_nr"] = reference_nr
+
+
+def reference_task(task):
+    function, reference_file, reference_nr, item = task
+    load_reference(reference_file, reference_nr)
+    return function(item)
+
+
+def imap_reference(proc_pool, function, items, reference_file=None):
+    # tasks of the processes, in the batch mode together with the file of the reference
+    if reference_file is None:
+        return proc_pool.imap_unordered(function, items)
+    reference_nr = next(REFERENCE_NR)
+    return proc_pool.imap_unordered(reference_task, ((function, reference_file, reference_nr, item)
+                                                     for item in items))
+
+
+def hamming_fused(array1, reference=None):
+    # TD of the whole tag and of both halves of the tags in one pass over the dataset
+    if reference is None:
+        reference = REFERENCE
+    engine = reference["engine"]
+    max_td = reference["max_td"]
+    array2 = reference["tags"]
+    words2 = reference["words"]
+    mask_a = reference["mask_a"]
+    mask_b = reference["mask_b"]
+    codes1 = tag_codes(array1)
+    words1 = pack_codes(codes1)
+    half_keys1 = half_keys(codes1)
+    rows1 = reference_rows(reference, array1)
+
+    ham = 99 * numpy.ones(len(array1))
+    if engine == "bktree":
+        for start in range(0, len(words1), BK_QUERY_BATCH):
+            ham[start:start + BK_QUERY_BATCH] = bk_tree_nearest(reference["tree"], words2,
+                                                                words1[start:start + BK_QUERY_BATCH], max_td)
+    if engine in ("mih", "bktree"):
+        index = reference["index"]
+        keys1 = segment_keys(index, codes1)
+        sub_radius_limit = max_sub_radius(index)
+
+    diff_list_a = [[] for i in range(11)]
+    diff_list_b = [[] for i in range(11)]
+    for i, tag in enumerate(array1):
+        matches = half_matches(reference["half_index"], [keys[i] for keys in half_keys1], rows1[i])
+        if engine not in ("mih", "bktree"):  # full scan
+            other, dist_a, dist_b = all_distances(words2, words1[i], mask_a, mask_b, rows1[i])
         else:
-            min_tagsList_zeros.append(None)
-            diff11_zeros.append(None)
-            max_tag_list.append(None)
-        i += 1
-    return ([diff11, ham1, ham2, min_valueList, min_tagsList, relativeDiffList, diff11_zeros,
-             min_tagsList_zeros, ham1min, ham2min, max_tag_list])
+            other, dist_a, dist_b = nearest_fused(index, words2, words1[i], keys1[i], mask_a, mask_b,
+                                                  rows1[i], matches, whole_tag=engine != "bktree", max_td=max_td,
+                                                  sub_radius_limit=sub_radius_limit)
+        if engine != "bktree":
+            ham[i] = numpy.amin(dist_a + dist_b)  # pick min distance greater than zero
+        add_half_distances(diff_list_a, tag, dist_a, dist_b, other, array2, mate_b=False)
+        add_half_distances(diff_list_b, tag, dist_b, dist_a, other, array2, mate_b=True)
+    if max_td > 0:
+        ham = numpy.minimum(ham, max_td + 1)
+    return ham, diff_list_a, diff_list_b
+
+
+def hamming_chunk(chunk):
+    nr, array1 = chunk
+    return nr, hamming_fused(array1)
+
+
+def report_progress(done, total, start_time, progress_file=None):
+    elapsed = time.time() - start_time
+    rate = done / elapsed if elapsed > 0 else 0.
+    eta = (total - done) / rate if rate > 0 else 0.
+    status = "TD analysis: {:,} of {:,} tags ({:.1f} tags/s, ETA {:.0f} s)".format(done, total, rate, eta)
+    sys.stderr.write(status + "\n")
+    if progress_file is not None:
+        with open(progress_file, "w") as progress:
+            progress.write(status + "\n")
+
+
+def hamming_parallel(proc_pool, array1, progress_file=None, reference_file=None):
+    # many small chunks are handed out to the processes as soon as they are idle and merged in the original order
+    nr_chunks = max(1, -(-len(array1) // TD_CHUNK_SIZE))
+    chunks = numpy.array_split(array1, nr_chunks)
+    results = [None] * nr_chunks
+    start_time = time.time()
+    last_report = start_time
+    done = 0
+    for nr, result in imap_reference(proc_pool, hamming_chunk, enumerate(chunks), reference_file):
+        results[nr] = result
+        done += len(chunks[nr])
+        if time.time() - last_report >= PROGRESS_INTERVAL or done == len(array1):
+            report_progress(done, len(array1), start_time, progress_file)
+            last_report = time.time()
+    return results
+
+
+def tile_size(nr_words, memory_budget):
+    # nr. of tags per block, so that the TDs of a block of tags to a block of tags fit into the memory budget (MB)
+    bytes_per_pair = 8 * 4 * nr_words + 2 * 6
+    return max(1, int((memory_budget * 2 ** 20 / bytes_per_pair) ** 0.5))
+
+
+def prepare_tiles(reference, array1, memory_budget=256, symmetric=False):
+    # the deduplicated sample is compared block by block to the blocks of the dataset, if the sample is the whole
+    # dataset the TD of each pair of tags can be computed only once (symmetric)
+    tags = numpy.unique(array1)
+    words = reference["words"]
+    rows = reference_rows(reference, tags)
+    reference["query_tags"] = tags
+    reference["query_words"] = words[rows] if (rows >= 0).all() else pack_codes(tag_codes(tags))
+    reference["self_rows"] = rows
+    reference["symmetric"] = symmetric and len(tags) == len(words) and (rows == numpy.arange(len(tags))).all()
+    reference["tile_size"] = tile_size(words.shape[1], memory_budget)
+    for key in ("query_tags", "query_words", "self_rows"):
+        reference[key].flags.writeable = False
+    return reference
+
+
+def tile_distances(query_words, words, mask_a, mask_b):
+    bits = mismatch_bits(words[None, :, :], query_words[:, None, :])
+    return count_mismatches(bits & mask_a, numpy.int16), count_mismatches(bits & mask_b, numpy.int16)
+
+
+def half_state(dist_half, dist_other, row_start, col_start):
+    # min. TD of the half, max. TD of the other half at the min. and the tied tags if one of both TDs is zero
+    min_value = dist_half.min(axis=1)
+    at_min = dist_half == min_value[:, None]
+    max_value = numpy.where(at_min, dist_other, -1).max(axis=1)
+    zeros = (min_value == 0) | (max_value == 0)
+    q, r = numpy.nonzero(at_min & (dist_other == max_value[:, None]) & zeros[:, None])
+    ties = numpy.column_stack((q + row_start, r + col_start, min_value[q], max_value[q]))
+    return min_value, max_value, ties
+
+
+def tile_state(dist_a, dist_b, row_start, col_start):
+    return ((dist_a + dist_b).min(axis=1), half_state(dist_a, dist_b, row_start, col_start),
+            half_state(dist_b, dist_a, row_start, col_start))
+
+
+def merge_half_state(state, other, row_start):
+    # running reduction: the smaller min. TD wins, equal min. TDs keep the larger max. TD of the other half
+    min1, max1, ties1 = state
+    min2, max2, ties2 = other
+    min_value = numpy.minimum(min1, min2)
+    max_value = numpy.where(min1 < min2, max1, numpy.where(min2 < min1, max2, numpy.maximum(max1, max2)))
+    ties = numpy.concatenate((ties1, ties2))
+    rows = ties[:, 0] - row_start
+    ties = ties[(ties[:, 2] == min_value[rows]) & (ties[:, 3] == max_value[rows])]
+    return min_value, max_value, ties
+
+
+def merge_tile_state(state, other, row_start):
+    if state is None:
+        return other
+    return (numpy.minimum(state[0], other[0]), merge_half_state(state[1], other[1], row_start),
+            merge_half_state(state[2], other[2], row_start))
+
+
+def hamming_tiles(start):
+    # all tiles of one block of the sample, in the symmetric case only the tiles on and right of the diagonal
+    # are computed and their TDs are also returned for the blocks of the columns
+    query_words = REFERENCE["query_words"]
+    words = REFERENCE["words"]
+    size = REFERENCE["tile_size"]
+    end = min(start + size, len(query_words))
+    self_rows = REFERENCE["self_rows"][start:end]
+    state = None
+    column_states = []
+    for col_start in range(start if REFERENCE["symmetric"] else 0, len(words), size):
+        col_end = min(col_start + size, len(words))
+        dist_a, dist_b = tile_distances(query_words[start:end], words[col_start:col_end],
+                                        REFERENCE["mask_a"], REFERENCE["mask_b"])
+        self_tile = numpy.where((self_rows >= col_start) & (self_rows < col_end))[0]  # exclude identical tag
+        dist_a[self_tile, self_rows[self_tile] - col_start] = words.shape[1] * BASES_PER_WORD + 1
+        dist_b[self_tile, self_rows[self_tile] - col_start] = words.shape[1] * BASES_PER_WORD + 1
+        state = merge_tile_state(state, tile_state(dist_a, dist_b, start, col_start), start)
+        if REFERENCE["symmetric"] and col_start != start:
+            column_states.append((col_start, tile_state(dist_a.T, dist_b.T, col_start, start)))
+    return start, state, column_states
+
+
+def hamming_all_tiles(proc_pool, array1, progress_file=None, reference_file=None):
+    # tiled TD analysis, the results of the blocks are merged in the main process
+    tags = REFERENCE["query_tags"]
+    size = REFERENCE["tile_size"]
+    states = {}
+    start_time = time.time()
+    last_report = start_time
+    done = 0
+    for start, state, column_states in imap_reference(proc_pool, hamming_tiles, range(0, len(tags), size),
+                                                      reference_file):
+        for row_start, row_state in [(start, state)] + column_states:
+            states[row_start] = merge_tile_state(states.get(row_start), row_state, row_start)
+        done += min(size, len(tags) - start)
+        if time.time() - last_report >= PROGRESS_INTERVAL or done == len(tags):
+            report_progress(done, len(tags), start_time, progress_file)
+            last_report = time.time()
+
+    ham = numpy.concatenate([states[start][0] for start in sorted(states)])
+    halves = []
+    for half in (1, 2):
+        min_value = numpy.concatenate([states[start][half][0] for start in sorted(states)])
+        max_value = numpy.concatenate([states[start][half][1] for start in sorted(states)])
+        ties = numpy.concatenate([states[start][half][2] for start in sorted(states)])
+        ties = ties[numpy.lexsort((ties[:, 1], ties[:, 0]))]
+        bounds = numpy.searchsorted(ties[:, 0], numpy.arange(len(tags) + 1))
+        halves.append((min_value, max_value, ties[:, 1], bounds))
+
+    # results of the unique tags are repeated for all tags of the sample
+    unique_rows = numpy.searchsorted(tags, array1)
+    diff_list_a = [[] for i in range(11)]
+    diff_list_b = [[] for i in range(11)]
+    for tag, row in zip(array1, unique_rows):
+        for result, (min_value, max_value, tie_rows, bounds), mate_b in \
+                zip((diff_list_a, diff_list_b), halves, (False, True)):
+            max_tag = REFERENCE["tags"][tie_rows[bounds[row]:bounds[row + 1]]]
+            add_half_result(result, tag, min_value[row], max_value[row], max_tag, mate_b)
+    ham = ham[unique_rows]
+    if REFERENCE["max_td"] > 0:
+        ham = numpy.minimum(ham, REFERENCE["max_td"] + 1)
+    return [(ham, diff_list_a, diff_list_b)]
+
+
+def tag_distance_analysis(array1, reference, nproc=4, progress_file=None, memory_budget=256, symmetric=False,
+                          proc_pool=None):
+    # TD of the whole tag and of both halves of the tags in array1, the same prepared reference
+    # (see prepare_reference) can be used for several analyses; with a persistent proc_pool (batch mode) the
+    # reference is handed to its processes by a memory-mapped temporary file (see dump_reference), otherwise the
+    # new processes are forked and share the reference of this process copy-on-write, which needs less memory than
+    # mapping a copy of it
+    if reference["engine"] == "tiled":
+        prepare_tiles(reference, array1, memory_budget, symmetric)
+    share_reference(reference)
+    reference_file = None
+    if proc_pool is None:
+        pool = Pool(nproc, initializer=share_reference, initargs=(reference,))
+    else:
+        pool = proc_pool
+    try:
+        if proc_pool is not None:
+            descriptor, reference_file = tempfile.mkstemp(suffix=".npy")
+            os.close(descriptor)
+            dump_reference(reference, reference_file)
+        if reference["engine"] == "tiled":
+            hd_results = hamming_all_tiles(pool, array1, progress_file, reference_file)
+        else:
+            hd_results = hamming_parallel(pool, array1, progress_file, reference_file)
+    except BaseException:
+        if proc_pool is None:
+            pool.terminate()
+        raise
+    finally:
+        if reference_file is not None:  # also if a worker failed or the run was interrupted
+            os.remove(reference_file)
+    if proc_pool is None:
+        pool.close()
+        pool.join()
+    return hd_results
+
+
+def tag_groups(tags):
+    # rows of each distinct tag, the tags of the input file are usually sorted already
+    if len(tags) > 1 and (tags[1:] >= tags[:-1]).all():
+        order = numpy.arange(len(tags))
+    else:
+        order = numpy.argsort(tags, kind="mergesort")
+    sorted_tags = tags[order]
+    starts = numpy.concatenate(([0], numpy.flatnonzero(sorted_tags[1:] != sorted_tags[:-1]) + 1))
+    return order, starts, numpy.diff(numpy.append(starts, len(tags)))
+
+
+def representative_rows(tags):
+    # one randomly chosen row of each distinct tag
+    order, starts, sizes = tag_groups(tags)
+    return order[starts + (numpy.random.random_sample(len(starts)) * sizes).astype(int)]
+
+
+def stratified_sample(rows, fs, size):
+    # the same nr. of tags for each family size category of hammingDistanceWithFS (1, 2, 3, 4, 5-10, >10),
+    # the quota of categories with too few tags is shared among the other categories
+    categories = numpy.digitize(fs, [2, 3, 4, 5, 11])
+    members = [rows[categories == c] for c in range(6)]
+    quotas = numpy.zeros(6, dtype=int)
+    remaining = size
+    order = numpy.argsort([len(m) for m in members], kind="mergesort")
+    for nr_left, c in zip(range(6, 0, -1), order):
+        quotas[c] = min(len(members[c]), remaining // nr_left)
+        remaining -= quotas[c]
+    return numpy.concatenate([numpy.random.choice(m, size=q, replace=False) for m, q in zip(members, quotas)])
 
 
 def readFileReferenceFree(file):
-    with open(file, 'r') as dest_f:
-        data_array = numpy.genfromtxt(dest_f, skip_header=0, delimiter='\t', comments='#', dtype='string')
-        integers = numpy.array(data_array[:, 0]).astype(int)
-        return (integers, data_array)
+    # typed columns of the input file: family sizes, tags (S{length of the tag}) and ab/ba
+    fs, tags, strands = read_tag_table(file)
+    return (fs.astype(int), tags, strands)
 
 
 def hammingDistanceWithFS(fs, ham):
@@ -685,26 +1226,11 @@ def hammingDistanceWithFS(fs, ham):
     minimum = min(ham)
     ham = numpy.asarray(ham)
 
-    singletons = numpy.where(fs == 1)[0]
-    data = ham[singletons]
-
-    hd2 = numpy.where(fs == 2)[0]
-    data2 = ham[hd2]
-
-    hd3 = numpy.where(fs == 3)[0]
-    data3 = ham[hd3]
-
-    hd4 = numpy.where(fs == 4)[0]
-    data4 = ham[hd4]
-
-    hd5 = numpy.where((fs >= 5) & (fs <= 10))[0]
-    data5 = ham[hd5]
-
-    hd6 = numpy.where(fs > 10)[0]
-    data6 = ham[hd6]
-
-    list1 = [data, data2, data3, data4, data5, data6]
-    return (list1, maximum, minimum)
+    # FS categories 1, 2, 3, 4, 5-10 and >10
+    category = numpy.select([fs == 1, fs == 2, fs == 3, fs == 4, (fs >= 5) & (fs <= 10), fs > 10],
+                            range(6), -1)
+    table = contingencyTable(ham, category, 6)
+    return (table, maximum, minimum)
 
 
 def familySizeDistributionWithHD(fs, ham, diff=False, rel=True):
@@ -716,99 +1242,60 @@ def familySizeDistributionWithHD(fs, ham, diff=False, rel=True):
         fs[bigFamilies2] = 20
     maximum = max(fs)
     minimum = min(fs)
-    if diff is True:
-        hd0 = numpy.where(ham == 0)[0]
-        data0 = fs[hd0]
 
+    # TD categories 0 (only if diff), 1, 2, 3, 4, 5-8 and >8 or 0.1, ..., >0.8 for the relative differences
     if rel is True:
-        hd1 = numpy.where(ham == 0.1)[0]
+        values = (0.1, 0.2, 0.3, 0.4, 0.5, 0.8)
     else:
-        hd1 = numpy.where(ham == 1)[0]
-    data = fs[hd1]
+        values = (1, 2, 3, 4, 5, 8)
+    conditions = [ham == values[0], ham == values[1], ham == values[2], ham == values[3],
+                  (ham >= values[4]) & (ham <= values[5]), ham > values[5]]
+    if diff is True:
+        conditions.insert(0, ham == 0)
+    category = numpy.select(conditions, range(len(conditions)), -1)
+    table = contingencyTable(fs, category, len(conditions))
 
-    if rel is True:
-        hd2 = numpy.where(ham == 0.2)[0]
-    else:
-        hd2 = numpy.where(ham == 2)[0]
-    data2 = fs[hd2]
+    return (table, hammingDistances, maximum, minimum)
 
-    if rel is True:
-        hd3 = numpy.where(ham == 0.3)[0]
-    else:
-        hd3 = numpy.where(ham == 3)[0]
-    data3 = fs[hd3]
 
-    if rel is True:
-        hd4 = numpy.where(ham == 0.4)[0]
-    else:
-        hd4 = numpy.where(ham == 4)[0]
-    data4 = fs[hd4]
+def rowsOfTags(tags_dataset):
+    # rows of the dataset sorted by tag, the rows of one tag stay in their order; the rows of any tag are then
+    # found with searchsorted
+    order = numpy.argsort(tags_dataset, kind="mergesort")
+    return (order, tags_dataset[order])
 
-    if rel is True:
-        hd5 = numpy.where((ham >= 0.5) & (ham <= 0.8))[0]
-    else:
-        hd5 = numpy.where((ham >= 5) & (ham <= 8))[0]
-    data5 = fs[hd5]
-
-    if rel is True:
-        hd6 = numpy.where(ham > 0.8)[0]
-    else:
-        hd6 = numpy.where(ham > 8)[0]
-    data6 = fs[hd6]
 
-    if diff is True:
-        list1 = [data0, data, data2, data3, data4, data5, data6]
-    else:
-        list1 = [data, data2, data3, data4, data5, data6]
+def familySizesOfTag(fs, strands, rows_of_tags, tag):
+    # family sizes and read directions of all rows of a tag
+    order, sorted_tags = rows_of_tags
+    rows = order[numpy.searchsorted(sorted_tags, tag, side="left"):numpy.searchsorted(sorted_tags, tag, side="right")]
+    return ["{} {}".format(family_size, direction) for family_size, direction in zip(fs[rows], strands[rows])]
 
-    return (list1, hammingDistances, maximum, minimum)
 
-
-def hammingDistanceWithDCS(minHD_tags_zeros, diff_zeros, data_array):
-    diff_zeros = numpy.array(diff_zeros)
+def hammingDistanceWithDCS(minHD_tags_zeros, diff_zeros, rows_of_tags, strands):
+    diff_zeros = numpy.array(diff_zeros, dtype=int)
+    if len(diff_zeros) == 0:  # no chimeras, all categories are empty
+        return ((diff_zeros, numpy.zeros((0, 3))), 0, 0)
     maximum = numpy.amax(diff_zeros)
     minimum = numpy.amin(diff_zeros)
     minHD_tags_zeros = numpy.array(minHD_tags_zeros)
 
-    idx = numpy.concatenate([numpy.where(data_array[:, 1] == i)[0] for i in minHD_tags_zeros])
-    subset_data = data_array[idx, :]
-
-    seq = numpy.array(subset_data[:, 1])
+    # join of the chimeric tags with the rows of the dataset by sorting, a tag is counted once per row and per
+    # occurrence in minHD_tags_zeros: twice --> DCS, once --> SSCS
+    tags, inverse, multiplicity = numpy.unique(minHD_tags_zeros, return_inverse=True, return_counts=True)
+    order, sorted_tags = rows_of_tags
+    first_row = numpy.searchsorted(sorted_tags, tags, side="left")
+    c = (numpy.searchsorted(sorted_tags, tags, side="right") - first_row) * multiplicity
+    rest = c == 1
+    direction = numpy.zeros(len(tags), dtype=strands.dtype)
+    direction[rest] = strands[order[first_row[rest]]]
 
-    # find all unique tags and get the indices for ALL tags, but only once
-    u, index_unique, c = numpy.unique(numpy.array(seq), return_counts=True, return_index=True)
-    DCS_tags = u[c == 2]
-    rest_tags = u[c == 1]
-
-    dcs = numpy.repeat("DCS", len(DCS_tags))
-    idx_sscs = numpy.concatenate([numpy.where(subset_data[:, 1] == i)[0] for i in rest_tags])
-    sscs = subset_data[idx_sscs, 2]
-
-    all_tags = numpy.column_stack((numpy.concatenate((DCS_tags, subset_data[idx_sscs, 1])),
-                                   numpy.concatenate((dcs, sscs))))
-    hd_DCS = []
-    ab_SSCS = []
-    ba_SSCS = []
-
-    for i in range(len(all_tags)):
-        tag = all_tags[i, :]
-        hd = diff_zeros[numpy.where(minHD_tags_zeros == tag[0])[0]]
-
-        if tag[1] == "DCS":
-            hd_DCS.append(hd)
-        elif tag[1] == "ab":
-            ab_SSCS.append(hd)
-        elif tag[1] == "ba":
-            ba_SSCS.append(hd)
-
-    if len(hd_DCS) != 0:
-        hd_DCS = numpy.concatenate(hd_DCS)
-    if len(ab_SSCS) != 0:
-        ab_SSCS = numpy.concatenate(ab_SSCS)
-    if len(ba_SSCS) != 0:
-        ba_SSCS = numpy.concatenate(ba_SSCS)
-    list1 = [hd_DCS, ab_SSCS, ba_SSCS]  # list for plotting
-    return (list1, maximum, minimum)
+    # categories DCS, ab and ba of the tags taken over to their TDs
+    category = numpy.select([c == 2, rest & (direction == "ab"), rest & (direction == "ba")], range(3), -1)[inverse]
+    uniqueHD, count = contingencyTable(diff_zeros, category, 3)
+    if (count.sum(axis=0) == 0).any():
+        uniqueHD = uniqueHD.astype(float)  # labels TD=7.0 of the list-based version as long as one category is empty
+    return ((uniqueHD, count), maximum, minimum)
 
 
 def make_argparser():
@@ -818,10 +1305,33 @@ def make_argparser():
     parser.add_argument('--inputName1')
     parser.add_argument('--sample_size', default=1000, type=int,
                         help='Sample size of Tag distance analysis.')
-    parser.add_argument('--subset_tag', default=0, type=int,
-                        help='The tag is shortened to the given number.')
+    parser.add_argument('--sampling', default="uniform", choices=["uniform", "stratified"],
+                        help='The sample is drawn uniformly from the shuffled dataset (uniform) or with the same nr. '
+                             'of tags for each family size category 1, 2, 3, 4, 5-10 and >10 (stratified). The '
+                             'frequencies of a stratified sample are those of the sample and not of the dataset.')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='Seed of the random number generator to get the same sample in each run.')
+    parser.add_argument('--subset_tag', default=[0], type=int, nargs="+",
+                        help='The tag is shortened to the given number. With several numbers, the same sample of tags '
+                             'of full length is analysed for each length and all results are written to the same '
+                             'output files.')
     parser.add_argument('--nproc', default=4, type=int,
                         help='The tool runs with the given number of processors.')
+    parser.add_argument('--td_engine', default="mih", choices=["mih", "bktree", "scan", "tiled"],
+                        help='Search for the minimum tag distance with multi-index hashing of tag segments (mih), '
+                             'a BK-tree (bktree), by comparing each tag to all tags (scan) or by comparing blocks '
+                             'of tags to blocks of tags (tiled), which is the fastest for the all vs. all analysis. '
+                             'mih finds the min. TDs up to about half the nr. of bases of the tag (of each half) '
+                             'by its index; tags with larger min. TDs are compared to all tags, so that its worst '
+                             'case on very noisy tags is the running time of scan. The same holds for the halves '
+                             'of the tags with bktree.')
+    parser.add_argument('--max_td', default=0, type=int,
+                        help='The search for the minimum TD of the whole tag stops at this TD and all larger TDs '
+                             'are reported as >max_td. Set to 0 to get all TDs exactly.')
+    parser.add_argument('--memory_budget', default=256, type=int,
+                        help='Memory in MB per processor for a tile of the tiled TD analysis.')
+    parser.add_argument('--symmetric', action="store_true",
+                        help='The TD of each pair of tags is computed only once in the tiled all vs. all analysis.')
     parser.add_argument('--only_DCS', action="store_false",
                         help='Only tags of the DCSs are included in the HD analysis')
 
@@ -834,7 +1344,24 @@ def make_argparser():
     parser.add_argument('--nr_above_bars', action="store_true",
                         help='If False, values above bars in the histograms are removed')
     parser.add_argument('--rel_freq', action="store_false",
-                        help='If True, the relative frequencies are displayed.')
+                        help='If True, the relative frequencies are displayed. With a stratified sample, these are '
+                             'the frequencies of the sample and not of the dataset.')
+
+    parser.add_argument('--mode', default="all", choices=["all", "compute", "render", "update"],
+                        help='compute: only the TDs are calculated and saved to the artifact file, render: the plots '
+                             'and tables are created from the artifact file of an earlier run, all: both, update: '
+                             'the input file has the tags of new lanes, the artifact file is updated with them and '
+                             'the plots and tables are created. The update uses the settings and FS limits of the '
+                             'earlier run and pairs the strands of the new lanes with those of the earlier run.')
+    parser.add_argument('--artifact', default="td_results.npz", type=str,
+                        help='Name of the binary file with the results of the compute mode.')
+    parser.add_argument('--progress_file', default=None, type=str,
+                        help='The progress of the TD analysis is written to this file in addition to stderr.')
+    parser.add_argument('--batch', default=None, type=str,
+                        help='Manifest of several datasets that are analysed with the same options and processes, '
+                             'one dataset per line: input file, name, output tabular, output pdf, output tabular of '
+                             'the chimeras and the artifact file, which is only optional with --mode all, '
+                             'separated by tabs.')
 
     parser.add_argument('--output_tabular', default="data.tabular", type=str,
                         help='Name of the tabular file.')
@@ -846,7 +1373,243 @@ def make_argparser():
     return parser
 
 
-def Hamming_Distance_Analysis(argv):
+def hdResultsToArrays(hd_results):
+    # per sampled tag: min. TD of the whole tag, min. TD of each half, max. TD of the other half and the tags with
+    # these TDs if one of them is zero (chimeras)
+    ham = numpy.concatenate([item[0] for item in hd_results])
+    halves = []
+    for side, min_nr, max_nr in ((1, 1, 8), (2, 2, 9)):
+        min_value = numpy.concatenate([item[side][min_nr] for item in hd_results]).astype(int)
+        max_value = numpy.concatenate([item[side][max_nr] for item in hd_results]).astype(int)
+        max_tags = [numpy.atleast_1d(t) if t is not None else numpy.array([], dtype=numpy.string_)
+                    for item in hd_results for t in item[side][10]]
+        bounds = numpy.concatenate(([0], numpy.cumsum([len(t) for t in max_tags]))).astype(int)
+        halves.append((min_value, max_value, numpy.concatenate(max_tags), bounds))
+    return (ham, halves)
+
+
+def arraysToHdResults(array1, ham, halves):
+    diff_list_a = [[] for i in range(11)]
+    diff_list_b = [[] for i in range(11)]
+    for i, tag in enumerate(array1):
+        for result, (min_value, max_value, max_tags, bounds), mate_b in \
+                zip((diff_list_a, diff_list_b), halves, (False, True)):
+            add_half_result(result, tag, min_value[i], max_value[i], max_tags[bounds[i]:bounds[i + 1]], mate_b)
+    return [(ham, diff_list_a, diff_list_b)]
+
+
+def mergeTDArrays(results1, results2):
+    # running min. TDs of the same sampled tags against two sets of tags, as in merge_half_state the tags with the
+    # max. TD are kept from the set(s) that give the final min. and max. TD
+    ham1, halves1 = results1
+    ham2, halves2 = results2
+    halves = []
+    for (min1, max1, tags1, bounds1), (min2, max2, tags2, bounds2) in zip(halves1, halves2):
+        min_value = numpy.minimum(min1, min2)
+        max_value = numpy.where(min1 < min2, max1, numpy.where(min2 < min1, max2, numpy.maximum(max1, max2)))
+        keep1 = (min1 == min_value) & (max1 == max_value)
+        keep2 = (min2 == min_value) & (max2 == max_value)
+        max_tags = []
+        for i in range(len(min_value)):
+            if keep1[i]:
+                max_tags.append(tags1[bounds1[i]:bounds1[i + 1]])
+            if keep2[i]:
+                max_tags.append(tags2[bounds2[i]:bounds2[i + 1]])
+        lengths = (bounds1[1:] - bounds1[:-1]) * keep1 + (bounds2[1:] - bounds2[:-1]) * keep2
+        bounds = numpy.concatenate(([0], numpy.cumsum(lengths))).astype(int)
+        max_tags = numpy.concatenate(max_tags) if len(max_tags) != 0 else tags1[:0]
+        halves.append((min_value, max_value, max_tags, bounds))
+    return (numpy.minimum(ham1, ham2), halves)
+
+
+def appendTDArrays(results1, results2):
+    # results of further sampled tags
+    ham1, halves1 = results1
+    ham2, halves2 = results2
+    halves = [(numpy.concatenate((min1, min2)), numpy.concatenate((max1, max2)), numpy.concatenate((tags1, tags2)),
+               numpy.concatenate((bounds1, bounds2[1:] + bounds1[-1])))
+              for (min1, max1, tags1, bounds1), (min2, max2, tags2, bounds2) in zip(halves1, halves2)]
+    return (numpy.concatenate((ham1, ham2)), halves)
+
+
+def saveTDResults(artifact_file, argv, name1, onlyDuplicates, max_td, index_size, sampling, subsets, minFS, maxFS,
+                  fs, tags, strands, duplTagsBA, single, result, runs):
+    # the results in one compressed numpy file, the render mode reads it instead of the input: the tags of full
+    # length once as packed 2-bit codes (the shortened tags are derived from them), per length only the TDs of the
+    # sampled tags and the similar tags of the chimeras
+    arrays = {"arguments": numpy.array(" ".join(argv[1:])), "name": numpy.array(name1),
+              "only_DCS": numpy.array(onlyDuplicates), "max_td": numpy.array(max_td),
+              "sample_size": numpy.array(index_size), "sampling": numpy.array(sampling),
+              "subset_tag": numpy.array(subsets), "minFS": numpy.array(minFS), "maxFS": numpy.array(maxFS),
+              "fs": fs.astype(numpy.uint32), "words": pack_codes(tag_codes(tags)),
+              "tag_length": numpy.array(len(tags[0])), "strands": strands, "result": result,
+              "nr_runs": numpy.array(len(runs))}
+    if duplTagsBA is not None:
+        arrays["duplTagsBA"] = duplTagsBA.astype(numpy.uint32)
+    if single is not None:  # all tags before the pairing to DCSs, the strands of new lanes are paired with them
+        single_fs, single_tags, single_strands = single
+        arrays["single_fs"] = single_fs.astype(numpy.uint32)
+        arrays["single_words"] = pack_codes(tag_codes(single_tags))
+        arrays["single_strands"] = single_strands
+    for nr, (run_tags, ham, halves) in enumerate(runs):
+        arrays["ham_{}".format(nr)] = ham.astype(numpy.uint16)
+        for half, (min_value, max_value, max_tags, bounds) in zip("ab", halves):
+            arrays["min_{}_{}".format(half, nr)] = min_value.astype(numpy.uint16)
+            arrays["max_{}_{}".format(half, nr)] = max_value.astype(numpy.uint16)
+            arrays["max_tags_{}_{}".format(half, nr)] = pack_codes(tag_codes(max_tags))
+            arrays["bounds_{}_{}".format(half, nr)] = bounds.astype(numpy.uint32)
+    with open(artifact_file, "wb") as artifact:
+        numpy.savez_compressed(artifact, **arrays)
+
+
+def loadTDResults(artifact_file):
+    with numpy.load(artifact_file) as artifact:
+        subsets = [int(subset) for subset in artifact["subset_tag"]]
+        tags = unpack_tags(artifact["words"], int(artifact["tag_length"]))
+        runs = []
+        for nr, subset in enumerate(subsets):
+            run_tags = tags
+            if subset > 0:
+                run_tags = shorten_tags(tags, subset_columns(len(tags[0]), subset))
+            halves = [(artifact["min_{}_{}".format(half, nr)].astype(int),
+                       artifact["max_{}_{}".format(half, nr)].astype(int),
+                       unpack_tags(artifact["max_tags_{}_{}".format(half, nr)], len(run_tags[0])),
+                       artifact["bounds_{}_{}".format(half, nr)].astype(int))
+                      for half in "ab"]
+            runs.append((run_tags, artifact["ham_{}".format(nr)].astype(int), halves))
+        duplTagsBA = artifact["duplTagsBA"].astype(int) if "duplTagsBA" in artifact.files else None
+        single = None
+        if "single_fs" in artifact.files:
+            single = (artifact["single_fs"].astype(int), unpack_tags(artifact["single_words"], len(tags[0])),
+                      artifact["single_strands"])
+        return (str(artifact["name"]), bool(artifact["only_DCS"]), int(artifact["max_td"]),
+                int(artifact["sample_size"]), str(artifact["sampling"]), subsets, int(artifact["minFS"]),
+                int(artifact["maxFS"]), artifact["fs"].astype(int), tags, artifact["strands"], duplTagsBA, single,
+                artifact["result"], runs)
+
+
+class TDAnalysisError(Exception):
+    # invalid parameters or data of a dataset, the tool exits with the code (see main)
+    def __init__(self, message, code):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+def readTags(file, minFS, maxFS):
+    # family sizes, tags and ab/ba of the input file with only A, C, G, T and the FS filters applied
+    fs, tags, strands = readFileReferenceFree(file)
+    print("total nr of tags:", len(tags))
+
+    # filter tags out which contain any other character than ATCG or are shorter than the other tags
+    valid_tags, invalid_counts = validate_tags(tags)
+    nr_invalid = len(valid_tags) - numpy.count_nonzero(valid_tags)
+    if nr_invalid != 0:  # delete tags with N in the tag from data
+        print("nr of tags with any other character than A, T, C, G:", nr_invalid,
+              float(nr_invalid) / len(tags))
+        print("nr of tags with N:", invalid_counts["N"],
+              "nr of tags with other characters:", invalid_counts["other"],
+              "nr of tags shorter than the widest tag:", invalid_counts["shorter"])
+        fs, tags, strands = fs[valid_tags], tags[valid_tags], strands[valid_tags]
+        print("total nr of filtered tags:", len(tags))
+
+    # select family size for tags
+    selected = fs >= minFS
+    if maxFS > 0:
+        selected &= fs <= maxFS
+    fs, tags, strands = fs[selected], tags[selected], strands[selected]
+    if len(fs) != 0:
+        print("min FS", min(fs))
+        print("max FS", max(fs))
+    return (fs, tags, strands)
+
+
+def pairStrands(fs, tags, strands):
+    # only the DCSs, with the FS and ab/ba of their ab strand and the FS of their ba strand in duplTagsBA; the rows
+    # are sorted by tag and ab/ba, so the strands of a DCS are paired even if they are in different lanes
+    order = numpy.lexsort((strands, tags))
+    fs, tags, strands = fs[order], tags[order], strands[order]
+
+    # find all unique tags and keep the tags that occur twice (ab and ba)
+    u, c = numpy.unique(tags, return_counts=True)
+    dcs = numpy.in1d(tags, u[c == 2])
+
+    # get family sizes, tag for duplicates
+    duplTags = fs[dcs][0::2]  # ab of DCS
+    duplTagsBA = fs[dcs][1::2]  # ba of DCS
+    print("DCS in whole dataset", len(duplTags))
+    return (duplTags, tags[dcs][0::2], strands[dcs][0::2], duplTagsBA)
+
+
+def updateTDResults(tags_new, index_size, subsets, result, runs, reference_args):
+    # the results of an earlier run are updated with the tags of new lanes: the sampled tags are only compared to the
+    # new tags and, if all tags were sampled, the new tags are added to the sample and compared to all tags
+    nr_old = len(runs[0][0])
+    if len(tags_new) == 0:
+        print("no new tags in the new lanes.")
+        return (result, runs)
+    updated_runs = []
+    for subset, (tags, ham, halves) in zip(subsets, runs):
+        tags_add = tags_new
+        if subset > 0:
+            tags_add = shorten_tags(tags_add, subset_columns(len(tags_add[0]), subset))
+        if len(tags_add[0]) != len(tags[0]):
+            raise TDAnalysisError("the tags of the new lanes and of the earlier run have different lengths.", 8)
+        print("length of tag= ", len(tags[0]))
+
+        # identical tags are not compared, so only tags that are not in the earlier dataset change the min. TDs
+        new_tags = numpy.setdiff1d(tags_add, tags)
+        print("nr of new tags= ", len(new_tags))
+        if len(new_tags) != 0:
+            reference = prepare_reference(new_tags, *reference_args[:2])
+            hd_results = tag_distance_analysis(tags[result], reference, *reference_args[2:])
+            ham, halves = mergeTDArrays((ham, halves), hdResultsToArrays(hd_results))
+
+        tags = numpy.concatenate((tags, tags_add))
+        if index_size == 0:  # all vs. all comparison
+            reference = prepare_reference(tags, *reference_args[:2])
+            hd_results = tag_distance_analysis(tags_add, reference, *reference_args[2:])
+            ham, halves = appendTDArrays((ham, halves), hdResultsToArrays(hd_results))
+        updated_runs.append((tags, ham, halves))
+
+    if index_size == 0:
+        result = numpy.arange(0, len(updated_runs[0][0]), 1)
+    print("sample size= ", len(result), "of which new= ", len(result) - nr_old if index_size == 0 else 0)
+    return (result, updated_runs)
+
+
+def Batch_Analysis(argv, manifest, nproc, mode="all"):
+    # the datasets of the manifest are analysed one after the other with the same process pool; each dataset has its
+    # own artifact file, so it is required in the modes that read or write one
+    with open(manifest) as lines:
+        datasets = [line.rstrip("\n").split("\t") for line in lines if line.strip() and not line.startswith("#")]
+    for fields in datasets:
+        if len(fields) not in (5, 6):
+            raise TDAnalysisError("line of the manifest does not have 5 or 6 columns: {}".format(fields), 9)
+        if mode != "all" and len(fields) != 6:
+            raise TDAnalysisError("line of the manifest has no artifact file, which the mode {} needs: {}".format(
+                mode, fields), 9)
+    # a dataset that fails does not stop the analysis of the other datasets
+    failed = []
+    proc_pool = Pool(nproc)
+    try:
+        for fields in datasets:
+            dataset_argv = argv + ["--inputFile", fields[0], "--inputName1", fields[1], "--output_tabular",
+                                   fields[2], "--output_pdf", fields[3], "--output_chimeras_tabular", fields[4]]
+            if len(fields) == 6:
+                dataset_argv += ["--artifact", fields[5]]
+            try:
+                Hamming_Distance_Analysis(dataset_argv, proc_pool)
+            except (TDAnalysisError, EnvironmentError) as error:
+                print("analysis of {} failed: {}".format(fields[0], error))
+                failed.append(fields[0])
+    finally:
+        proc_pool.close()
+        proc_pool.join()
+    if len(failed) != 0:
+        raise TDAnalysisError("nr of failed datasets: {} of {}".format(len(failed), len(datasets)), 12)
+
+
+def Hamming_Distance_Analysis(argv, proc_pool=None):
     parser = make_argparser()
     args = parser.parse_args(argv[1:])
     file1 = args.inputFile
@@ -860,20 +1623,37 @@ def Hamming_Distance_Analysis(argv):
     minFS = args.minFS
     maxFS = args.maxFS
     nr_above_bars = args.nr_above_bars
-    subset = args.subset_tag
+    subsets = args.subset_tag
     nproc = args.nproc
+    td_engine = args.td_engine
+    progress_file = args.progress_file
+    memory_budget = args.memory_budget
+    max_td = args.max_td
+    symmetric = args.symmetric
+    sampling = args.sampling
+    mode = args.mode
+    artifact_file = args.artifact
+    seed = args.seed
     sep = "\t"
 
     # input checks
     if index_size < 0:
-        print("index_size is a negative integer.")
-        exit(2)
+        raise TDAnalysisError("index_size is a negative integer.", 2)
     if nproc <= 0:
-        print("nproc is smaller or equal zero")
-        exit(3)
-    if subset < 0:
-        print("subset_tag is smaller or equal zero.")
-        exit(5)
+        raise TDAnalysisError("nproc is smaller or equal zero", 3)
+    if min(subsets) < 0:
+        raise TDAnalysisError("subset_tag is smaller or equal zero.", 5)
+    if memory_budget <= 0:
+        raise TDAnalysisError("memory_budget is smaller or equal zero.", 6)
+    if max_td < 0 or 0 < max_td < 8:
+        raise TDAnalysisError("max_td is negative or smaller than 8, but all TDs up to 8 are needed for the plots.",
+                              7)
+
+    if args.batch is not None and proc_pool is None:
+        return Batch_Analysis(argv, args.batch, nproc, mode)
+
+    if seed is not None:
+        numpy.random.seed(seed)
 
     # PLOT
     plt.rcParams['axes.facecolor'] = "E0E0E0"  # grey background color
@@ -881,210 +1661,179 @@ def Hamming_Distance_Analysis(argv):
     plt.rcParams['ytick.labelsize'] = 14
     plt.rcParams['patch.edgecolor'] = "#000000"
     plt.rc('figure', figsize=(11.69, 8.27))  # A4 format
-    name1 = name1.split(".tabular")[0]
 
-    with open(title_savedFile_csv, "w") as output_file, PdfPages(title_savedFile_pdf) as pdf:
+    if mode == "render" or mode == "update":  # results of an earlier run in compute mode
+        name1, onlyDuplicates, max_td, index_size, sampling, subsets, minFS, maxFS, fs, tags_full, strands, \
+            duplTagsBA, single, result, runs = loadTDResults(artifact_file)
+        if mode == "update":
+            # the new lanes are filtered with the FS limits of the earlier run
+            print("dataset: ", name1, "new lanes: ", file1)
+            fs_new, tags_new, strands_new = readTags(file1, minFS, maxFS)
+            if onlyDuplicates:
+                # the strands of the new lanes are paired with the strands of the earlier run, the DCSs of the earlier
+                # run must stay DCSs, i.e. the new lanes must not have further strands of them
+                single = tuple(numpy.concatenate((old, new)) for old, new in
+                               zip(single, (fs_new, tags_new, strands_new)))
+                fs_dcs, tags_dcs, strands_dcs, duplTagsBA_dcs = pairStrands(*single)
+                if not numpy.in1d(tags_full, tags_dcs).all():
+                    raise TDAnalysisError("the new lanes have further strands of DCSs of the earlier run, the "
+                                          "analysis has to be repeated with all lanes.", 10)
+                new = ~numpy.in1d(tags_dcs, tags_full)
+                fs_new, tags_new, strands_new = fs_dcs[new], tags_dcs[new], strands_dcs[new]
+                duplTagsBA_new = duplTagsBA_dcs[new]
+            result, runs = updateTDResults(tags_new, index_size, subsets, result, runs,
+                                           (td_engine, max_td, nproc, progress_file, memory_budget, symmetric,
+                                            proc_pool))
+            fs = numpy.concatenate((fs, fs_new))
+            tags_full = numpy.concatenate((tags_full, tags_new))
+            strands = numpy.concatenate((strands, strands_new))
+            if duplTagsBA is not None:
+                duplTagsBA = numpy.concatenate((duplTagsBA, duplTagsBA_new))
+            saveTDResults(artifact_file, argv, name1, onlyDuplicates, max_td, index_size, sampling, subsets, minFS,
+                          maxFS, fs, tags_full, strands, duplTagsBA, single, result, runs)
+    else:
+        name1 = name1.split(".tabular")[0]
         print("dataset: ", name1)
-        integers, data_array = readFileReferenceFree(file1)
-        data_array = numpy.array(data_array)
-        print("total nr of tags:", len(data_array))
-
-        # filter tags out which contain any other character than ATCG
-        valid_bases = ["A", "T", "G", "C"]
-        tagsToDelete = []
-        for idx, t in enumerate(data_array[:, 1]):
-            for char in t:
-                if char not in valid_bases:
-                    tagsToDelete.append(idx)
-                    break
-
-        if len(tagsToDelete) != 0:  # delete tags with N in the tag from data
-            print("nr of tags with any other character than A, T, C, G:", len(tagsToDelete),
-                  float(len(tagsToDelete)) / len(data_array))
-            index_whole_array = numpy.arange(0, len(data_array), 1)
-            index_withoutN_inTag = numpy.delete(index_whole_array, tagsToDelete)
-            data_array = data_array[index_withoutN_inTag, :]
-            integers = integers[index_withoutN_inTag]
-            print("total nr of filtered tags:", len(data_array))
-
-        int_f = numpy.array(data_array[:, 0]).astype(int)
-        data_array = data_array[numpy.where(int_f >= minFS)]
-        integers = integers[integers >= minFS]
-
-        # select family size for tags
-        if maxFS > 0:
-            int_f2 = numpy.array(data_array[:, 0]).astype(int)
-            data_array = data_array[numpy.where(int_f2 <= maxFS)]
-            integers = integers[integers <= maxFS]
-
-        if onlyDuplicates is True:
-            tags = data_array[:, 2]
-            seq = data_array[:, 1]
-
-            # find all unique tags and get the indices for ALL tags, but only once
-            u, index_unique, c = numpy.unique(numpy.array(seq), return_counts=True, return_index=True)
-            d = u[c == 2]
-
-            # get family sizes, tag for duplicates
-            duplTags_double = integers[numpy.in1d(seq, d)]
-            duplTags = duplTags_double[0::2]  # ab of DCS
-            duplTagsBA = duplTags_double[1::2]  # ba of DCS
-
-            duplTags_tag = tags[numpy.in1d(seq, d)][0::2]  # ab
-            duplTags_seq = seq[numpy.in1d(seq, d)][0::2]  # ab - tags
-
-            if minFS > 1:
-                duplTags_tag = duplTags_tag[(duplTags >= minFS) & (duplTagsBA >= minFS)]
-                duplTags_seq = duplTags_seq[(duplTags >= minFS) & (duplTagsBA >= minFS)]
-                duplTags = duplTags[(duplTags >= minFS) & (duplTagsBA >= minFS)]  # ab+ba with FS>=3
-
-            data_array = numpy.column_stack((duplTags, duplTags_seq))
-            data_array = numpy.column_stack((data_array, duplTags_tag))
-            integers = numpy.array(data_array[:, 0]).astype(int)
-            print("DCS in whole dataset", len(data_array))
-
-        print("min FS", min(integers))
-        print("max FS", max(integers))
-
-        # HD analysis for a subset of the tag
-        if subset > 0:
-            tag1 = numpy.array([i[0:(len(i)) / 2] for i in data_array[:, 1]])
-            tag2 = numpy.array([i[len(i) / 2:len(i)] for i in data_array[:, 1]])
-
-            flanking_region_float = float((len(tag1[0]) - subset)) / 2
-            flanking_region = int(flanking_region_float)
-            if flanking_region_float % 2 == 0:
-                tag1_shorten = numpy.array([i[flanking_region:len(i) - flanking_region] for i in tag1])
-                tag2_shorten = numpy.array([i[flanking_region:len(i) - flanking_region] for i in tag2])
-            else:
-                flanking_region_rounded = int(round(flanking_region, 1))
-                flanking_region_rounded_end = len(tag1[0]) - subset - flanking_region_rounded
-                tag1_shorten = numpy.array(
-                    [i[flanking_region:len(i) - flanking_region_rounded_end] for i in tag1])
-                tag2_shorten = numpy.array(
-                    [i[flanking_region:len(i) - flanking_region_rounded_end] for i in tag2])
-
-            data_array_tag = numpy.array([i + j for i, j in zip(tag1_shorten, tag2_shorten)])
-            data_array = numpy.column_stack((data_array[:, 0], data_array_tag, data_array[:, 2]))
+        single = readTags(file1, minFS, maxFS)
+        fs, tags_full, strands = single
+        duplTagsBA = None
+        if onlyDuplicates:
+            fs, tags_full, strands, duplTagsBA = pairStrands(*single)
+        else:
+            single = None
+        if len(tags_full) == 0:
+            raise TDAnalysisError("no tags are left after the filters.", 11)
 
-        print("length of tag= ", len(data_array[0, 1]))
         # select sample: if no size given --> all vs. all comparison
+        # the sample is drawn once from the distinct tags of full length and the same rows are analysed for all
+        # lengths of the tag, so that the results do not depend on the order of the lengths; a shortened tag can
+        # occur in several rows of the sample
         if index_size == 0:
-            result = numpy.arange(0, len(data_array), 1)
-        else:
-            numpy.random.shuffle(data_array)
-            unique_tags, unique_indices = numpy.unique(data_array[:, 1], return_index=True)  # get only unique tags
-            result = numpy.random.choice(unique_indices, size=index_size,
-                                         replace=False)  # array of random sequences of size=index.size
-
-        # comparison random tags to whole dataset
-        result1 = data_array[result, 1]  # random tags
-        result2 = data_array[:, 1]  # all tags
-        print("sample size= ", len(result1))
-
-        # HD analysis of whole tag
-        proc_pool = Pool(nproc)
-        chunks_sample = numpy.array_split(result1, nproc)
-        ham = proc_pool.map(partial(hamming, array2=result2), chunks_sample)
-        proc_pool.close()
-        proc_pool.join()
-        ham = numpy.concatenate(ham).astype(int)
-        # with open("HD_whole dataset_{}.txt".format(app_f), "w") as output_file1:
-        # for h, tag in zip(ham, result1):
-        #     output_file1.write("{}\t{}\n".format(tag, h))
-
-        proc_pool_b = Pool(nproc)
-        diff_list_a = proc_pool_b.map(partial(hamming_difference, array2=result2, mate_b=False), chunks_sample)
-        diff_list_b = proc_pool_b.map(partial(hamming_difference, array2=result2, mate_b=True), chunks_sample)
-        proc_pool_b.close()
-        proc_pool_b.join()
-        HDhalf1 = numpy.concatenate((numpy.concatenate([item[1] for item in diff_list_a]),
-                                     numpy.concatenate([item_b[1] for item_b in diff_list_b]))).astype(int)
-        HDhalf2 = numpy.concatenate((numpy.concatenate([item[2] for item in diff_list_a]),
-                                     numpy.concatenate([item_b[2] for item_b in diff_list_b]))).astype(int)
-        minHDs = numpy.concatenate((numpy.concatenate([item[3] for item in diff_list_a]),
-                                    numpy.concatenate([item_b[3] for item_b in diff_list_b]))).astype(int)
-        HDhalf1min = numpy.concatenate((numpy.concatenate([item[8] for item in diff_list_a]),
-                                        numpy.concatenate([item_b[8] for item_b in diff_list_b]))).astype(int)
-        HDhalf2min = numpy.concatenate((numpy.concatenate([item[9] for item in diff_list_a]),
-                                        numpy.concatenate([item_b[9] for item_b in diff_list_b]))).astype(int)
-
-        rel_Diff1 = numpy.concatenate([item[5] for item in diff_list_a])
-        rel_Diff2 = numpy.concatenate([item[5] for item in diff_list_b])
-        diff1 = numpy.concatenate([item[0] for item in diff_list_a])
-        diff2 = numpy.concatenate([item[0] for item in diff_list_b])
-
-        diff_zeros1 = numpy.concatenate([item[6] for item in diff_list_a])
-        diff_zeros2 = numpy.concatenate([item[6] for item in diff_list_b])
-        minHD_tags = numpy.concatenate([item[4] for item in diff_list_a])
-        minHD_tags_zeros1 = numpy.concatenate([item[7] for item in diff_list_a])
-        minHD_tags_zeros2 = numpy.concatenate([item[7] for item in diff_list_b])
-
-        chimera_tags1 = sum([item[10] for item in diff_list_a], [])
-        chimera_tags2 = sum([item[10] for item in diff_list_b], [])
-
-        rel_Diff = []
-        diff_zeros = []
-        minHD_tags_zeros = []
-        diff = []
-        chimera_tags = []
-        for d1, d2, rel1, rel2, zeros1, zeros2, tag1, tag2, ctag1, ctag2 in \
-                zip(diff1, diff2, rel_Diff1, rel_Diff2, diff_zeros1, diff_zeros2, minHD_tags_zeros1, minHD_tags_zeros2,
-                    chimera_tags1, chimera_tags2):
-            relatives = numpy.array([rel1, rel2])
-            absolutes = numpy.array([d1, d2])
-            max_idx = numpy.argmax(relatives)
-            rel_Diff.append(relatives[max_idx])
-            diff.append(absolutes[max_idx])
-
-            if all(i is not None for i in [zeros1, zeros2]):
-                diff_zeros.append(max(zeros1, zeros2))
-                minHD_tags_zeros.append(str(tag1))
-                tags = [ctag1, ctag2]
-                chimera_tags.append(tags)
-            elif zeros1 is not None and zeros2 is None:
-                diff_zeros.append(zeros1)
-                minHD_tags_zeros.append(str(tag1))
-                chimera_tags.append(ctag1)
-            elif zeros1 is None and zeros2 is not None:
-                diff_zeros.append(zeros2)
-                minHD_tags_zeros.append(str(tag2))
-                chimera_tags.append(ctag2)
-
-        chimera_tags_new = chimera_tags
-        data_chimeraAnalysis = numpy.column_stack((minHD_tags_zeros, chimera_tags_new))
-
-        checked_tags = []
-        stat_maxTags = []
-
-        with open(output_chimeras_tabular, "w") as output_file1:
+            result = numpy.arange(0, len(tags_full), 1)
+        else:  # one row per distinct tag, the columns keep the order of the input file
+            rows = representative_rows(tags_full)
+            if sampling == "stratified":
+                result = stratified_sample(rows, fs[rows], index_size)
+            else:
+                result = numpy.random.choice(rows, size=index_size,
+                                             replace=False)  # array of random sequences of size=index.size
+
+        runs = []
+        for subset in subsets:
+            tags = tags_full
+            # HD analysis for a subset of the tag
+            if subset > 0:
+                tags = shorten_tags(tags, subset_columns(len(tags[0]), subset))
+
+            print("length of tag= ", len(tags[0]))
+            # comparison random tags to whole dataset
+            result1 = tags[result]  # random tags
+            print("sample size= ", len(result1))
+
+            # HD analysis of whole tag and of both halves of the tag
+            reference = prepare_reference(tags, td_engine, max_td)
+            hd_results = tag_distance_analysis(result1, reference, nproc, progress_file, memory_budget, symmetric,
+                                               proc_pool)
+            runs.append((tags, ) + hdResultsToArrays(hd_results))
+
+        if mode == "compute":
+            saveTDResults(artifact_file, argv, name1, onlyDuplicates, max_td, index_size, sampling, subsets, minFS,
+                          maxFS, fs, tags_full, strands, duplTagsBA, single, result, runs)
+            return
+
+    # the frequencies of a stratified sample are per family size category and not those of the dataset
+    stratified = index_size != 0 and sampling == "stratified"
+    with open(title_savedFile_csv, "w") as output_file, open(output_chimeras_tabular, "w") as output_file1, \
+            PdfPages(title_savedFile_pdf) as pdf:
+        for tags, ham, halves in runs:
+            hd_results = arraysToHdResults(tags[result], ham, halves)
+            if len(runs) > 1:
+                name_subset = "{} (tag length {})".format(name1, len(tags[0]))
+                plotTitlePage(name_subset, pdf)
+            else:
+                name_subset = name1
+            ham = numpy.concatenate([item[0] for item in hd_results]).astype(int)
+            diff_list_a = [item[1] for item in hd_results]
+            diff_list_b = [item[2] for item in hd_results]
+            HDhalf1 = numpy.concatenate((numpy.concatenate([item[1] for item in diff_list_a]),
+                                         numpy.concatenate([item_b[1] for item_b in diff_list_b]))).astype(int)
+            HDhalf2 = numpy.concatenate((numpy.concatenate([item[2] for item in diff_list_a]),
+                                         numpy.concatenate([item_b[2] for item_b in diff_list_b]))).astype(int)
+            minHDs = numpy.concatenate((numpy.concatenate([item[3] for item in diff_list_a]),
+                                        numpy.concatenate([item_b[3] for item_b in diff_list_b]))).astype(int)
+            HDhalf1min = numpy.concatenate((numpy.concatenate([item[8] for item in diff_list_a]),
+                                            numpy.concatenate([item_b[8] for item_b in diff_list_b]))).astype(int)
+            HDhalf2min = numpy.concatenate((numpy.concatenate([item[9] for item in diff_list_a]),
+                                            numpy.concatenate([item_b[9] for item_b in diff_list_b]))).astype(int)
+
+            rel_Diff1 = numpy.concatenate([item[5] for item in diff_list_a])
+            rel_Diff2 = numpy.concatenate([item[5] for item in diff_list_b])
+            diff1 = numpy.concatenate([item[0] for item in diff_list_a])
+            diff2 = numpy.concatenate([item[0] for item in diff_list_b])
+
+            diff_zeros1 = numpy.concatenate([item[6] for item in diff_list_a])
+            diff_zeros2 = numpy.concatenate([item[6] for item in diff_list_b])
+            minHD_tags = numpy.concatenate([item[4] for item in diff_list_a])
+            minHD_tags_zeros1 = numpy.concatenate([item[7] for item in diff_list_a])
+            minHD_tags_zeros2 = numpy.concatenate([item[7] for item in diff_list_b])
+
+            chimera_tags1 = sum([item[10] for item in diff_list_a], [])
+            chimera_tags2 = sum([item[10] for item in diff_list_b], [])
+
+            rel_Diff = []
+            diff_zeros = []
+            minHD_tags_zeros = []
+            diff = []
+            chimera_tags = []
+            for d1, d2, rel1, rel2, zeros1, zeros2, tag1, tag2, ctag1, ctag2 in \
+                    zip(diff1, diff2, rel_Diff1, rel_Diff2, diff_zeros1, diff_zeros2, minHD_tags_zeros1, minHD_tags_zeros2,
+                        chimera_tags1, chimera_tags2):
+                relatives = numpy.array([rel1, rel2])
+                absolutes = numpy.array([d1, d2])
+                max_idx = numpy.argmax(relatives)
+                rel_Diff.append(relatives[max_idx])
+                diff.append(absolutes[max_idx])
+
+                if all(i is not None for i in [zeros1, zeros2]):
+                    diff_zeros.append(max(zeros1, zeros2))
+                    minHD_tags_zeros.append(str(tag1))
+                    chimera_tags.append([ctag1, ctag2])
+                elif zeros1 is not None and zeros2 is None:
+                    diff_zeros.append(zeros1)
+                    minHD_tags_zeros.append(str(tag1))
+                    chimera_tags.append(ctag1)
+                elif zeros1 is None and zeros2 is not None:
+                    diff_zeros.append(zeros2)
+                    minHD_tags_zeros.append(str(tag2))
+                    chimera_tags.append(ctag2)
+
+            # family sizes and read directions of the rows of a tag are looked up in the sorted tags
+            rows_of_tags = rowsOfTags(tags)
+
+            checked_tags = set()
+            stat_maxTags = []
+
+            if len(runs) > 1:
+                output_file1.write("{}\n".format(name_subset))
             output_file1.write("chimera tag\tfamily size, read direction\tsimilar tag with TD=0\n")
-            for i in range(len(data_chimeraAnalysis)):
-                tag1 = data_chimeraAnalysis[i, 0]
-
-                info_tag1 = data_array[data_array[:, 1] == tag1, :]
-                fs_tag1 = ["{} {}".format(t[0], t[2]) for t in info_tag1]
-
+            for tag1, max_tags in zip(minHD_tags_zeros, chimera_tags):
                 if tag1 in checked_tags:  # skip tag if already written to file
                     continue
 
                 sample_half_a = tag1[0:(len(tag1)) / 2]
                 sample_half_b = tag1[len(tag1) / 2:len(tag1)]
 
-                max_tags = data_chimeraAnalysis[i, 1]
-                if len(max_tags) > 1 and len(max_tags) != len(data_array[0, 1]) and type(max_tags) is not numpy.ndarray:
+                if isinstance(max_tags, list):  # tags of both halves
                     max_tags = numpy.concatenate(max_tags)
                 max_tags = numpy.unique(max_tags)
                 stat_maxTags.append(len(max_tags))
 
-                info_maxTags = [data_array[data_array[:, 1] == t, :] for t in max_tags]
-
                 chimera_half_a = numpy.array([t[0:(len(t)) / 2] for t in max_tags])  # mate1 part1
                 chimera_half_b = numpy.array([t[len(t) / 2:len(t)] for t in max_tags])  # mate1 part 2
 
                 new_format = []
                 for j in range(len(max_tags)):
-                    fs_maxTags = ["{} {}".format(t[0], t[2]) for t in info_maxTags[j]]
+                    fs_maxTags = familySizesOfTag(fs, strands, rows_of_tags, max_tags[j])
 
                     if sample_half_a == chimera_half_a[j]:
                         max_tag = "*{}* {} {}".format(chimera_half_a[j], chimera_half_b[j], ", ".join(fs_maxTags))
@@ -1093,11 +1842,11 @@ def Hamming_Distance_Analysis(argv):
                     elif sample_half_b == chimera_half_b[j]:
                         max_tag = "{} *{}* {}".format(chimera_half_a[j], chimera_half_b[j], ", ".join(fs_maxTags))
                         new_format.append(max_tag)
-                    checked_tags.append(max_tags[j])
+                    checked_tags.add(max_tags[j])
 
-                sample_tag = "{} {}\t{}".format(sample_half_a, sample_half_b, ", ".join(fs_tag1))
+                sample_tag = "{} {}\t{}".format(sample_half_a, sample_half_b, ", ".join(familySizesOfTag(fs, strands, rows_of_tags, tag1)))
                 output_file1.write("{}\t{}\n".format(sample_tag, ", ".join(new_format)))
-                checked_tags.append(tag1)
+                checked_tags.add(tag1)
 
             output_file1.write(
                 "This file contains all tags that were identified as chimeras as the first column and the "
@@ -1110,187 +1859,208 @@ def Hamming_Distance_Analysis(argv):
             output_file1.write("median\t{}\ttag(s)\n".format(numpy.median(numpy.array(stat_maxTags))))
             output_file1.write("maximum\t{}\ttag(s)\n".format(numpy.amax(numpy.array(stat_maxTags))))
             output_file1.write("sum\t{}\ttag(s)\n".format(numpy.sum(numpy.array(stat_maxTags))))
+            if len(runs) > 1:
+                output_file1.write("\n")
+
+            lenTags = len(tags)
+            len_sample = len(result)
+
+            quant = fs[result]  # family size for sample of tags
+            seq = tags[result]  # tags of sample
+            ham = numpy.asarray(ham)  # HD for sample of tags
+
+            if onlyDuplicates is True:  # ab and ba strands of DCSs
+                quant = numpy.concatenate((quant, duplTagsBA[result]))
+                seq = numpy.tile(seq, 2)
+                ham = numpy.tile(ham, 2)
+                diff = numpy.tile(diff, 2)
+                rel_Diff = numpy.tile(rel_Diff, 2)
+                diff_zeros = numpy.tile(diff_zeros, 2)
+
+            nr_chimeric_tags = len(minHD_tags_zeros)
+            print("nr of chimeras", nr_chimeric_tags)
+
+            # prepare data for different kinds of plots
+            # distribution of FSs separated after HD
+            tableFS, hammingDistances, maximumXFS, minimumXFS = familySizeDistributionWithHD(quant, ham, rel=False)
+            tableHD, maximumX, minimumX = hammingDistanceWithFS(quant, ham)  # histogram of HDs separated after FS
+
+            # get FS for all tags with min HD of analysis of chimeric reads
+            # there are more tags than sample size in the plot, because one tag can have multiple minimas
+            if onlyDuplicates:
+                seqDic = defaultdict(list)
+                for s, q in zip(seq, quant):
+                    seqDic[s].append(q)
+            else:
+                seqDic = dict(zip(seq, quant))
 
-        lenTags = len(data_array)
-        len_sample = len(result1)
+            lst_minHD_tags = []
+            for i in minHD_tags:
+                lst_minHD_tags.append(seqDic.get(i))
 
-        quant = numpy.array(data_array[result, 0]).astype(int)  # family size for sample of tags
-        seq = numpy.array(data_array[result, 1])  # tags of sample
-        ham = numpy.asarray(ham)  # HD for sample of tags
+            if onlyDuplicates:
+                lst_minHD_tags = numpy.concatenate(([item[0] for item in lst_minHD_tags],
+                                                    [item_b[1] for item_b in lst_minHD_tags])).astype(int)
+            # histogram with absolute and relative difference between HDs of both parts of the tag
+            tableDifference, maximumXDifference, minimumXDifference = hammingDistanceWithFS(lst_minHD_tags, diff)
+            tableRelDifference, maximumXRelDifference, minimumXRelDifference = hammingDistanceWithFS(lst_minHD_tags, rel_Diff)
+            # chimeric read analysis: tags which have TD=0 in one of the halfs
+            if len(minHD_tags_zeros) != 0:
+                lst_minHD_tags_zeros = []
+                for i in minHD_tags_zeros:
+                    lst_minHD_tags_zeros.append(seqDic.get(i))  # get family size for tags of chimeric reads
+                if onlyDuplicates:
+                    lst_minHD_tags_zeros = numpy.concatenate(([item[0] for item in lst_minHD_tags_zeros],
+                                                              [item_b[1] for item_b in lst_minHD_tags_zeros])).astype(int)
+
+                # histogram with HD of non-identical half
+                tableDifference_zeros, maximumXDifference_zeros, minimumXDifference_zeros = hammingDistanceWithFS(
+                    lst_minHD_tags_zeros, diff_zeros)
+
+                if onlyDuplicates is False:
+                    tableDCS_zeros, maximumXDCS_zeros, minimumXDCS_zeros = hammingDistanceWithDCS(minHD_tags_zeros, diff_zeros, rows_of_tags, strands)
+
+            # plot Hamming Distance with Family size distribution
+            plotHDwithFSD(table=tableHD, maximumX=maximumX, minimumX=minimumX, pdf=pdf, rel_freq=rel_freq,
+                          subtitle="Tag distance separated by family size", lenTags=lenTags,
+                          xlabel="TD", nr_above_bars=nr_above_bars, len_sample=len_sample, max_td=max_td,
+                          stratified=stratified)
+
+            # Plot FSD with separation after
+            plotFSDwithHD2(tableFS, maximumXFS, minimumXFS, rel_freq=rel_freq,
+                           originalCounts=quant, subtitle="Family size distribution separated by Tag distance",
+                           pdf=pdf, relative=False, diff=False, stratified=stratified)
+
+            # Plot HD within tags
+            tableWithinTags = tableOfLists([HDhalf1, HDhalf1min, HDhalf2, HDhalf2min, minHDs])
+            plotHDwithinSeq(tableWithinTags, pdf=pdf, lenTags=lenTags, rel_freq=rel_freq, len_sample=len_sample,
+                            stratified=stratified)
+
+            # Plot difference between HD's separated after FSD
+            plotHDwithFSD(tableDifference, maximumXDifference, minimumXDifference, pdf=pdf,
+                          subtitle="Delta Tag distance within tags", lenTags=lenTags, rel_freq=rel_freq,
+                          xlabel="absolute delta TD", relative=False, nr_above_bars=nr_above_bars, len_sample=len_sample,
+                          stratified=stratified)
+
+            plotHDwithFSD(tableRelDifference, maximumXRelDifference, minimumXRelDifference, pdf=pdf,
+                          subtitle="Chimera Analysis: relative delta Tag distance", lenTags=lenTags, rel_freq=rel_freq,
+                          xlabel="relative delta TD", relative=True, nr_above_bars=nr_above_bars,
+                          nr_unique_chimeras=nr_chimeric_tags, len_sample=len_sample, stratified=stratified)
+
+            # plots for chimeric reads
+            if len(minHD_tags_zeros) != 0:
+                # HD
+                plotHDwithFSD(tableDifference_zeros, maximumXDifference_zeros, minimumXDifference_zeros, pdf=pdf,
+                              subtitle="Tag distance of chimeric families (CF)", rel_freq=rel_freq,
+                              lenTags=lenTags, xlabel="TD", relative=False,
+                              nr_above_bars=nr_above_bars, nr_unique_chimeras=nr_chimeric_tags, len_sample=len_sample,
+                              stratified=stratified)
 
-        if onlyDuplicates is True:  # ab and ba strands of DCSs
-            quant = numpy.concatenate((quant, duplTagsBA[result]))
-            seq = numpy.tile(seq, 2)
-            ham = numpy.tile(ham, 2)
-            diff = numpy.tile(diff, 2)
-            rel_Diff = numpy.tile(rel_Diff, 2)
-            diff_zeros = numpy.tile(diff_zeros, 2)
+                if onlyDuplicates is False:
+                    plotHDwithDCS(tableDCS_zeros, maximumXDCS_zeros, minimumXDCS_zeros, pdf=pdf,
+                                  subtitle="Tag distance of chimeric families (CF)", rel_freq=rel_freq,
+                                  lenTags=lenTags, xlabel="TD", relative=False,
+                                  nr_above_bars=nr_above_bars, nr_unique_chimeras=nr_chimeric_tags, len_sample=len_sample,
+                                  stratified=stratified)
 
-        nr_chimeric_tags = len(data_chimeraAnalysis)
-        print("nr of chimeras", nr_chimeric_tags)
+            # print all data to a CSV file
+            # HD
+            summary, sumCol = createTableHD(tableHD, "TD=")
+            if max_td > 0:  # all TDs above max_td
+                summary[summary[:, 0] == "TD={}".format(max_td + 1), 0] = "TD>{}".format(max_td)
+            overallSum = sum(sumCol)  # sum of columns in table
 
-        # prepare data for different kinds of plots
-        # distribution of FSs separated after HD
-        familySizeList1, hammingDistances, maximumXFS, minimumXFS = familySizeDistributionWithHD(quant, ham, rel=False)
-        list1, maximumX, minimumX = hammingDistanceWithFS(quant, ham)  # histogram of HDs separated after FS
+            # FSD
+            summary5, sumCol5 = createTableFSD2(tableFS)
+            overallSum5 = sum(sumCol5)
 
-        # get FS for all tags with min HD of analysis of chimeric reads
-        # there are more tags than sample size in the plot, because one tag can have multiple minimas
-        if onlyDuplicates:
-            seqDic = defaultdict(list)
-            for s, q in zip(seq, quant):
-                seqDic[s].append(q)
-        else:
-            seqDic = dict(zip(seq, quant))
+            # HD of both parts of the tag
+            summary9, sumCol9 = createTableHDwithTags(tableWithinTags)
+            overallSum9 = sum(sumCol9)
 
-        lst_minHD_tags = []
-        for i in minHD_tags:
-            lst_minHD_tags.append(seqDic.get(i))
+            # HD
+            # absolute difference
+            summary11, sumCol11 = createTableHD(tableDifference, "diff=")
+            overallSum11 = sum(sumCol11)
+            # relative difference and all tags
+            summary13, sumCol13 = createTableHD(tableRelDifference, "diff=")
+            overallSum13 = sum(sumCol13)
+
+            # chimeric reads
+            if len(minHD_tags_zeros) != 0:
+                # absolute difference and tags where at least one half has HD=0
+                summary15, sumCol15 = createTableHD(tableDifference_zeros, "TD=")
+                overallSum15 = sum(sumCol15)
+
+                if onlyDuplicates is False:
+                    summary16, sumCol16 = createTableHDwithDCS(tableDCS_zeros)
+                    overallSum16 = sum(sumCol16)
+
+            output_file.write("{}\n".format(name_subset))
+            output_file.write("nr of tags{}{:,}\nsample size{}{:,}\n".format(sep, lenTags, sep, len_sample))
+            if stratified:
+                output_file.write("sampling{}stratified by family size, the frequencies are those of the sample with "
+                                  "the same nr. of tags in each family size category\n".format(sep))
+            output_file.write("\n")
 
-        if onlyDuplicates:
-            lst_minHD_tags = numpy.concatenate(([item[0] for item in lst_minHD_tags],
-                                                [item_b[1] for item_b in lst_minHD_tags])).astype(int)
-        # histogram with absolute and relative difference between HDs of both parts of the tag
-        listDifference1, maximumXDifference, minimumXDifference = hammingDistanceWithFS(lst_minHD_tags, diff)
-        listRelDifference1, maximumXRelDifference, minimumXRelDifference = hammingDistanceWithFS(lst_minHD_tags, rel_Diff)
-        # chimeric read analysis: tags which have TD=0 in one of the halfs
-        if len(minHD_tags_zeros) != 0:
-            lst_minHD_tags_zeros = []
-            for i in minHD_tags_zeros:
-                lst_minHD_tags_zeros.append(seqDic.get(i))  # get family size for tags of chimeric reads
-            if onlyDuplicates:
-                lst_minHD_tags_zeros = numpy.concatenate(([item[0] for item in lst_minHD_tags_zeros],
-                                                          [item_b[1] for item_b in lst_minHD_tags_zeros])).astype(int)
-
-            # histogram with HD of non-identical half
-            listDifference1_zeros, maximumXDifference_zeros, minimumXDifference_zeros = hammingDistanceWithFS(
-                lst_minHD_tags_zeros, diff_zeros)
-
-            if onlyDuplicates is False:
-                listDCS_zeros, maximumXDCS_zeros, minimumXDCS_zeros = hammingDistanceWithDCS(minHD_tags_zeros, diff_zeros, data_array)
-
-        # plot Hamming Distance with Family size distribution
-        plotHDwithFSD(list1=list1, maximumX=maximumX, minimumX=minimumX, pdf=pdf, rel_freq=rel_freq,
-                      subtitle="Tag distance separated by family size", lenTags=lenTags,
-                      xlabel="TD", nr_above_bars=nr_above_bars, len_sample=len_sample)
-
-        # Plot FSD with separation after
-        plotFSDwithHD2(familySizeList1, maximumXFS, minimumXFS, rel_freq=rel_freq,
-                       originalCounts=quant, subtitle="Family size distribution separated by Tag distance",
-                       pdf=pdf, relative=False, diff=False)
-
-        # Plot HD within tags
-        plotHDwithinSeq(HDhalf1, HDhalf1min, HDhalf2, HDhalf2min, minHDs, pdf=pdf, lenTags=lenTags,
-                        rel_freq=rel_freq, len_sample=len_sample)
-
-        # Plot difference between HD's separated after FSD
-        plotHDwithFSD(listDifference1, maximumXDifference, minimumXDifference, pdf=pdf,
-                      subtitle="Delta Tag distance within tags", lenTags=lenTags, rel_freq=rel_freq,
-                      xlabel="absolute delta TD", relative=False, nr_above_bars=nr_above_bars, len_sample=len_sample)
-
-        plotHDwithFSD(listRelDifference1, maximumXRelDifference, minimumXRelDifference, pdf=pdf,
-                      subtitle="Chimera Analysis: relative delta Tag distance", lenTags=lenTags, rel_freq=rel_freq,
-                      xlabel="relative delta TD", relative=True, nr_above_bars=nr_above_bars,
-                      nr_unique_chimeras=nr_chimeric_tags, len_sample=len_sample)
-
-        # plots for chimeric reads
-        if len(minHD_tags_zeros) != 0:
             # HD
-            plotHDwithFSD(listDifference1_zeros, maximumXDifference_zeros, minimumXDifference_zeros, pdf=pdf,
-                          subtitle="Tag distance of chimeric families (CF)", rel_freq=rel_freq,
-                          lenTags=lenTags, xlabel="TD", relative=False,
-                          nr_above_bars=nr_above_bars, nr_unique_chimeras=nr_chimeric_tags, len_sample=len_sample)
+            createFileHD(summary, sumCol, overallSum, output_file,
+                         "Tag distance separated by family size", sep)
+            # FSD
+            createFileFSD2(summary5, sumCol5, overallSum5, output_file,
+                           "Family size distribution separated by Tag distance", sep,
+                           diff=False)
+
+            # output_file.write("{}{}\n".format(sep, name1))
+            output_file.write("\n")
+            max_fs = numpy.bincount(fs[result])
+            output_file.write("max. family size in sample:{}{}\n".format(sep, max(fs[result])))
+            output_file.write("absolute frequency:{}{}\n".format(sep, max_fs[len(max_fs) - 1]))
+            output_file.write(
+                "relative frequency:{}{}\n\n".format(sep, float(max_fs[len(max_fs) - 1]) / sum(max_fs)))
 
-            if onlyDuplicates is False:
-                plotHDwithDCS(listDCS_zeros, maximumXDCS_zeros, minimumXDCS_zeros, pdf=pdf,
-                              subtitle="Tag distance of chimeric families (CF)", rel_freq=rel_freq,
-                              lenTags=lenTags, xlabel="TD", relative=False,
-                              nr_above_bars=nr_above_bars, nr_unique_chimeras=nr_chimeric_tags, len_sample=len_sample)
-
-        # print all data to a CSV file
-        # HD
-        summary, sumCol = createTableHD(list1, "TD=")
-        overallSum = sum(sumCol)  # sum of columns in table
-
-        # FSD
-        summary5, sumCol5 = createTableFSD2(familySizeList1, diff=False)
-        overallSum5 = sum(sumCol5)
-
-        # HD of both parts of the tag
-        summary9, sumCol9 = createTableHDwithTags([HDhalf1, HDhalf1min, HDhalf2, HDhalf2min, numpy.array(minHDs)])
-        overallSum9 = sum(sumCol9)
-
-        # HD
-        # absolute difference
-        summary11, sumCol11 = createTableHD(listDifference1, "diff=")
-        overallSum11 = sum(sumCol11)
-        # relative difference and all tags
-        summary13, sumCol13 = createTableHD(listRelDifference1, "diff=")
-        overallSum13 = sum(sumCol13)
-
-        # chimeric reads
-        if len(minHD_tags_zeros) != 0:
-            # absolute difference and tags where at least one half has HD=0
-            summary15, sumCol15 = createTableHD(listDifference1_zeros, "TD=")
-            overallSum15 = sum(sumCol15)
-
-            if onlyDuplicates is False:
-                summary16, sumCol16 = createTableHDwithDCS(listDCS_zeros)
-                overallSum16 = sum(sumCol16)
-
-        output_file.write("{}\n".format(name1))
-        output_file.write("nr of tags{}{:,}\nsample size{}{:,}\n\n".format(sep, lenTags, sep, len_sample))
-
-        # HD
-        createFileHD(summary, sumCol, overallSum, output_file,
-                     "Tag distance separated by family size", sep)
-        # FSD
-        createFileFSD2(summary5, sumCol5, overallSum5, output_file,
-                       "Family size distribution separated by Tag distance", sep,
-                       diff=False)
-
-        # output_file.write("{}{}\n".format(sep, name1))
-        output_file.write("\n")
-        max_fs = numpy.bincount(integers[result])
-        output_file.write("max. family size in sample:{}{}\n".format(sep, max(integers[result])))
-        output_file.write("absolute frequency:{}{}\n".format(sep, max_fs[len(max_fs) - 1]))
-        output_file.write(
-            "relative frequency:{}{}\n\n".format(sep, float(max_fs[len(max_fs) - 1]) / sum(max_fs)))
-
-        # HD within tags
-        output_file.write(
-            "Chimera Analysis:\nThe tags are splitted into two halves (part a and b) for which the Tag distances (TD) are calculated seperately.\n"
-            "The tag distance of the first half (part a) is calculated by comparing part a of the tag in the sample against all a parts in the dataset and by selecting the minimum value (TD a.min).\n"
-            "In the next step, we select those tags that showed the minimum TD and estimate the TD for the second half (part b) of the tag by comparing part b against the previously selected subset.\n"
-            "The maximum value represents then TD b.max. Finally, these process is repeated but starting with part b instead and TD b.min and TD a.max are calculated.\n"
-            "Next, the absolute differences between TD a.min & TD b.max and TD b.min & TD a.max are estimated (delta HD).\n"
-            "These are then divided by the sum of both parts (TD a.min + TD b.max or TD b.min + TD a.max, respectively) which give the relative differences between the partial HDs (rel. delta HD).\n"
-            "For simplicity, we used the maximum value of the relative differences and the respective delta HD.\n"
-            "Note that when only tags that can form a DCS are included in the analysis, the family sizes for both directions (ab and ba) of the strand will be included in the plots.\n")
-
-        output_file.write("\nlength of one half of the tag{}{}\n\n".format(sep, len(data_array[0, 1]) / 2))
-
-        createFileHDwithinTag(summary9, sumCol9, overallSum9, output_file,
-                              "Tag distance of each half in the tag", sep)
-        createFileHD(summary11, sumCol11, overallSum11, output_file,
-                     "Absolute delta Tag distance within the tag", sep)
-
-        createFileHD(summary13, sumCol13, overallSum13, output_file,
-                     "Chimera analysis: relative delta Tag distance", sep)
-
-        if len(minHD_tags_zeros) != 0:
+            # HD within tags
             output_file.write(
-                "All tags are filtered and only those tags where one half is identical (TD=0) and therefore, have a relative delta TD of 1, are kept.\n"
-                "These tags are considered as chimeras.\n")
-            createFileHD(summary15, sumCol15, overallSum15, output_file,
-                         "Tag distance of chimeric families separated after FS", sep)
+                "Chimera Analysis:\nThe tags are splitted into two halves (part a and b) for which the Tag distances (TD) are calculated seperately.\n"
+                "The tag distance of the first half (part a) is calculated by comparing part a of the tag in the sample against all a parts in the dataset and by selecting the minimum value (TD a.min).\n"
+                "In the next step, we select those tags that showed the minimum TD and estimate the TD for the second half (part b) of the tag by comparing part b against the previously selected subset.\n"
+                "The maximum value represents then TD b.max. Finally, these process is repeated but starting with part b instead and TD b.min and TD a.max are calculated.\n"
+                "Next, the absolute differences between TD a.min & TD b.max and TD b.min & TD a.max are estimated (delta HD).\n"
+                "These are then divided by the sum of both parts (TD a.min + TD b.max or TD b.min + TD a.max, respectively) which give the relative differences between the partial HDs (rel. delta HD).\n"
+                "For simplicity, we used the maximum value of the relative differences and the respective delta HD.\n"
+                "Note that when only tags that can form a DCS are included in the analysis, the family sizes for both directions (ab and ba) of the strand will be included in the plots.\n")
 
-            if onlyDuplicates is False:
-                createFileHDwithDCS(summary16, sumCol16, overallSum16, output_file,
-                                    "Tag distance of chimeric families separated after DCS and single SSCS (ab, ba)", sep)
+            output_file.write("\nlength of one half of the tag{}{}\n\n".format(sep, len(tags[0]) / 2))
 
-        output_file.write("\n")
+            createFileHDwithinTag(summary9, sumCol9, overallSum9, output_file,
+                                  "Tag distance of each half in the tag", sep)
+            createFileHD(summary11, sumCol11, overallSum11, output_file,
+                         "Absolute delta Tag distance within the tag", sep)
+
+            createFileHD(summary13, sumCol13, overallSum13, output_file,
+                         "Chimera analysis: relative delta Tag distance", sep)
+
+            if len(minHD_tags_zeros) != 0:
+                output_file.write(
+                    "All tags are filtered and only those tags where one half is identical (TD=0) and therefore, have a relative delta TD of 1, are kept.\n"
+                    "These tags are considered as chimeras.\n")
+                createFileHD(summary15, sumCol15, overallSum15, output_file,
+                             "Tag distance of chimeric families separated after FS", sep)
+
+                if onlyDuplicates is False:
+                    createFileHDwithDCS(summary16, sumCol16, overallSum16, output_file,
+                                        "Tag distance of chimeric families separated after DCS and single SSCS (ab, ba)", sep)
+
+            output_file.write("\n")
+
+
+def main(argv):
+    try:
+        return Hamming_Distance_Analysis(argv)
+    except TDAnalysisError as error:
+        print(error)
+        return error.code
 
 
 if __name__ == '__main__':
-    sys.exit(Hamming_Distance_Analysis(sys.argv))
+    sys.exit(main(sys.argv))
@@ -0,0 +1,91 @@
+import os
+import stat
+
+import numpy
+
+import tag_table
+import td
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-data")
+
+
+def compute_artifact(tmpdir, name, *options):
+    artifact = str(tmpdir.join(name))
+    td.Hamming_Distance_Analysis(["td.py", "--inputFile", os.path.join(TEST_DATA, "td_data.tab"),
+                                  "--inputName1", "td_data.tab", "--nproc", "1", "--only_DCS", "--mode", "compute",
+                                  "--artifact", artifact] + list(options))
+    return td.loadTDResults(artifact)
+
+
+def test_seed_gives_same_uniform_sample(tmpdir):
+    first = compute_artifact(tmpdir, "first.npz", "--sample_size", "10", "--seed", "1")
+    second = compute_artifact(tmpdir, "second.npz", "--sample_size", "10", "--seed", "1")
+    numpy.testing.assert_array_equal(first[13], second[13])
+    # one row per distinct tag
+    assert len(numpy.unique(first[9][first[13]])) == 10
+
+    # the columns keep the order of the input file, only the rows of the sample are drawn
+    fs, tags, strands = td.readTags(os.path.join(TEST_DATA, "td_data.tab"), 1, 0)
+    numpy.testing.assert_array_equal(first[8], fs)
+    numpy.testing.assert_array_equal(first[9], tags)
+    numpy.testing.assert_array_equal(first[10], strands)
+
+
+def test_batch_goes_on_after_failed_dataset(tmpdir):
+    # no tags are left after the ACGT filter of the second dataset
+    failing = tmpdir.join("td_failing.tab")
+    failing.write("1\tAAAAAAAAAAAANAAAAAAAAAAA\tab\n")
+    manifest = tmpdir.join("manifest.tabular")
+    lines = []
+    for nr, file in enumerate([os.path.join(TEST_DATA, "td_data.tab"), str(failing),
+                               os.path.join(TEST_DATA, "td_data.tab")]):
+        lines.append("\t".join([file, "dataset{}".format(nr)] +
+                               [str(tmpdir.join("out{}.{}".format(nr, ext))) for ext in ("tab", "pdf", "chim.tab")]))
+    manifest.write("\n".join(lines) + "\n")
+    assert td.main(["td.py", "--batch", str(manifest), "--sample_size", "0", "--nproc", "1", "--only_DCS"]) == 12
+    for nr in (0, 2):
+        with open(str(tmpdir.join("out{}.tab".format(nr)))) as output, \
+                open(os.path.join(TEST_DATA, "td_output.tab")) as expected:
+            assert output.read().replace("dataset{}".format(nr), "td_data.tab") == expected.read()
+    assert not tmpdir.join("out1.tab").exists()
+
+
+def test_shorter_tags_are_invalid():
+    # the shorter tag is padded with null bytes to the width of the tag column
+    valid, counts = td.validate_tags(numpy.array(["ACGTAC", "ACGTA", "ACNTAC", "ACGTA-"]))
+    numpy.testing.assert_array_equal(valid, [True, False, False, False])
+    assert counts == {"N": 1, "other": 1, "shorter": 1}
+
+
+def test_cache_of_tag_table(tmpdir, monkeypatch):
+    monkeypatch.setenv(tag_table.CACHE_DIR_VARIABLE, str(tmpdir))
+    file = os.path.join(TEST_DATA, "td_data.tab")
+    umask = os.umask(0o027)
+    try:
+        parsed = tag_table.read_tag_table(file)
+    finally:
+        os.umask(umask)
+    cached = tag_table.read_tag_table(file)
+    # the second read maps the read-only arrays of the cache
+    assert not cached[1].flags.writeable
+    for parsed_column, cached_column in zip(parsed, cached):
+        numpy.testing.assert_array_equal(parsed_column, cached_column)
+    cache = tag_table.cache_file(file)
+    assert os.path.dirname(cache) == str(tmpdir)
+    assert stat.S_IMODE(os.stat(cache).st_mode) == 0o640
+
+
+def test_batch_compute_needs_artifact_per_dataset(tmpdir):
+    manifest = tmpdir.join("manifest.tabular")
+    lines = ["\t".join([os.path.join(TEST_DATA, file), file] +
+                       [str(tmpdir.join("out{}.{}".format(nr, ext))) for ext in ("tab", "pdf", "chim.tab", "npz")])
+             for nr, file in enumerate(["td_data.tab", "td_update_lane1.tab"])]
+    manifest.write("\n".join(lines) + "\n")
+    options = ["--sample_size", "0", "--nproc", "1", "--only_DCS", "--mode", "compute"]
+    assert td.main(["td.py", "--batch", str(manifest)] + options) is None
+    assert [td.loadTDResults(str(tmpdir.join("out{}.npz".format(nr))))[0] for nr in (0, 1)] == \
+        ["td_data.tab", "td_update_lane1.tab"]
+
+    # without the 6th column all datasets would write the same artifact file
+    manifest.write("\n".join(line.rsplit("\t", 1)[0] for line in lines) + "\n")
+    assert td.main(["td.py", "--batch", str(manifest)] + options) == 9